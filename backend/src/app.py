@@ -1,20 +1,31 @@
 from celery.result import AsyncResult
-from celery.signals import setup_logging
+from celery.signals import setup_logging, task_prerun, task_postrun
 from utils import get_analysis, use_args
-from routes.disassembly_routes import disassembly_route
+from routes.disassembly_routes import disassembly_route, disassembly_task_name, symbolic_task_name
 from routes.information_routes import information_route
 from routes.lookup_routes import lookup_route
-from shared import app, inspect, celery
+from shared import app, inspect, celery, redis
 from utils.source import categorize_abi_names
-from utils.format import str_timestamp_to_date
+from utils.format import queued_tasks
 from utils.mongo import Mongo
-from flask import request
+from utils.redis import single_flight, refresh_entry, flight_stats_key
+from utils.metrics import metrics, render, collect
+from flask import request, g, Response
+import socket
+import time
 
 
+analysis_task_names = [disassembly_task_name, symbolic_task_name]
+
 app.register_blueprint(disassembly_route, url_prefix="/disassembly")
 app.register_blueprint(information_route, url_prefix="/information")
 app.register_blueprint(lookup_route, url_prefix="/lookup")
 
+try:
+    Mongo().create_indexes()
+except Exception as exception:
+    print(f"creating mongodb indexes failed with following error: {exception}")
+
 
 @setup_logging.connect
 # prevent celery from overriding logging and breaking mythril analysis workaround taken from this issue: https://github.com/celery/celery/issues/1867
@@ -27,12 +38,64 @@ def void(*args, **kwargs):
     pass
 
 
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    # endpoints instead of paths so that every address does not create its own series
+    if "request_start" in g:
+        metrics.observe("request_seconds", time.perf_counter() - g.request_start,
+                        endpoint=request.endpoint or "unknown", status=response.status_code)
+    metrics.flush()
+    return response
+
+
+task_starts = {}
+
+
+@task_prerun.connect
+def start_task_timer(task_id=None, **kwargs):
+    task_starts[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def record_task(task_id=None, task=None, state=None, **kwargs):
+    start = task_starts.pop(task_id, None)
+    if start != None:
+        metrics.observe("task_seconds", time.perf_counter() -
+                        start, task=task.name, state=state)
+    metrics.record_peak_rss(task.request.hostname or socket.gethostname())
+    metrics.flush()
+
+
 @app.route("/source/<address>")
 def analyse_source(address):
 
     token = request.args.get('etherscan')
     rpc = request.args.get('rpc')
 
+    cache_key = source_cache_key(address)
+
+    return single_flight(redis, cache_key, lambda: load_source(address, token, rpc, cache_key),
+                         lambda: refresh_source.delay(address, token, rpc))
+
+
+def source_cache_key(address):
+    return f"{address}-source"
+
+
+@celery.task(name="refresh_source", queue="light")
+def refresh_source(address, token, rpc):
+    cache_key = source_cache_key(address)
+    refresh_entry(redis, cache_key, lambda: load_source(
+        address, token, rpc, cache_key))
+
+
+def load_source(address, token, rpc, cache_key):
+
     try:
         analysis = get_analysis(address, use_args(
             etherscan_token=token, ethpector_rpc=rpc))
@@ -62,24 +125,12 @@ def analyse_source(address):
 
     source_metadata = summary.source_metadata['etherscan']
 
-    return {"source_code": source_code, "source_abi": source_abi, "source_metadata": source_metadata, "functions": functions, "events": events}
+    data = {"source_code": source_code, "source_abi": source_abi,
+            "source_metadata": source_metadata, "functions": functions, "events": events}
 
+    redis.set_fresh_to_cache(cache_key, data)
 
-def queued_tasks(task_dict, status):
-    tasks = []
-    for worker in task_dict:
-        for task in task_dict[worker]:
-            formatted_task = {}
-            formatted_task['contract'] = task['args'][0]
-            formatted_task['args'] = task['args'][2]
-            formatted_task['timestamp'] = str_timestamp_to_date(
-                int(task['time_start']))
-            formatted_task['type'] = task['type']
-            formatted_task['id'] = task['id']
-            formatted_task['status'] = status
-            tasks.append(formatted_task)
-
-    return tasks
+    return data
 
 
 @app.route("/tasks")
@@ -88,8 +139,9 @@ def get_tasks():
     received_tasks = inspect.reserved()
     tasks = []
 
-    tasks += queued_tasks(worker_tasks, "active")
-    tasks += queued_tasks(received_tasks, "waiting")
+    # only analyses are listed, the arguments of other tasks contain the etherscan token and rpc url of their caller
+    tasks += queued_tasks(worker_tasks, "active", analysis_task_names)
+    tasks += queued_tasks(received_tasks, "waiting", analysis_task_names)
 
     return {"tasks": tasks}
 
@@ -109,5 +161,19 @@ def get_status(task_id):
 @app.route("/contracts")
 def get_contracts():
     mongo = Mongo()
-    contracts = mongo.db['contracts'].distinct("contract")
+    contracts = mongo.analysed_addresses()
+    mongo.close()
     return {"contracts": contracts}
+
+
+@app.route("/stats")
+def get_stats():
+    # counts how often cache misses were computed, served the previous value or waited for another request
+    return {"singleFlight": redis.get_counters(flight_stats_key)}
+
+
+@app.route("/metrics")
+def get_metrics():
+    # prometheus text format of the samples of the web tier and all workers
+    metrics.flush()
+    return Response(render(collect(redis, flight_stats_key)), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,50 @@
+'''
+Compares the size and speed of redis cache entries written as plain json (the previous format)
+and with the codecs of utils.codec.
+
+Run from backend/src: python -m benchmarks.cache_encoding [events]
+'''
+import json
+import random
+import sys
+import time
+from decimal import Decimal
+from utils.codec import ZlibCodec, ZstdCodec, decode, json_default
+
+
+def synthetic_events(event_count):
+    # decoded transfer events like the events route caches them
+    random.seed(0)
+    addresses = ["0x" + "".join(random.choice("0123456789abcdef")
+                                for _ in range(40)) for _ in range(20)]
+    return {"events": [{"signature": "Transfer(address,address,uint256)",
+                        "indexedValues": [{"from": random.choice(addresses)}, {"to": random.choice(addresses)}],
+                        "unindexedValues": [{"value": random.getrandbits(90)}],
+                        "timestamp": "08-01-2023 10:53:11 UTC",
+                        "transactionHash": "0x" + "".join(random.choice("0123456789abcdef") for _ in range(64))}
+                       for _ in range(event_count)],
+            "balance": Decimal("12.5"), "nextCursor": "16361475-1"}
+
+
+def measure(encode, value, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        encoded = encode(value)
+    encode_duration = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        decode(encoded)
+    decode_duration = (time.perf_counter() - start) / repeat
+
+    return len(encoded), encode_duration, decode_duration
+
+
+if __name__ == "__main__":
+    event_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    value = synthetic_events(event_count)
+
+    for name, encode in [("plain json", lambda value: json.dumps(value, default=json_default).encode("utf-8")),
+                         ("json + zlib", ZlibCodec().encode), ("json + zstd", ZstdCodec().encode)]:
+        size, encode_duration, decode_duration = measure(encode, value)
+        print(f"{name:<16} {size / 1024:8.1f} KiB  encode {encode_duration * 1000:6.2f} ms  decode {decode_duration * 1000:6.2f} ms")
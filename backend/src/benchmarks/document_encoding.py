@@ -0,0 +1,76 @@
+'''
+Compares the single pass to_document encoder with the previous to_json + IntDecoder round trip
+that was used to make analysis results storable in mongodb.
+
+Run from backend/src: python -m benchmarks.document_encoding [instructions]
+'''
+import json
+import random
+import sys
+import time
+import tracemalloc
+import pyevmasm as EVMAsm
+from ethpector.assembly.program import Instruction
+from ethpector.data.datatypes import to_json
+from datatypes.data import ReportedBasicBlocks, Push, TypedAnnotation
+from datatypes.json_mapping import to_document
+
+
+class IntDecoder(json.JSONDecoder):
+    # previous implementation, kept here for comparison
+    def decode(self, s):
+        result = super().decode(s)
+        return self._decode(result)
+
+    def _decode(self, o):
+        if isinstance(o, int):
+            return str(o)
+        elif isinstance(o, dict):
+            return {k: self._decode(v) for k, v in o.items()}
+        elif isinstance(o, list):
+            return [self._decode(v) for v in o]
+        else:
+            return o
+
+
+def round_trip(analysis):
+    return json.loads(to_json(analysis), cls=IntDecoder)
+
+
+def synthetic_analysis(instruction_count):
+    # disassembly of random bytecode with a push annotation on every push, big operands included
+    random.seed(0)
+    code = bytes(random.getrandbits(8) for _ in range(instruction_count * 3))
+    instructions = [Instruction(instruction) for instruction in EVMAsm.disassemble_all(code)][:instruction_count]
+    for instruction in instructions:
+        if instruction.is_push():
+            annotation = Push(tags={}, pc=instruction.pc(), value=instruction.operand())
+            instruction.annotations = [TypedAnnotation(_class="Push", data=annotation)]
+
+    bbs = [ReportedBasicBlocks(i=index, instructions=instructions[start:start + 10], annotations=[], nextBlockIndex=index + 1)
+           for index, start in enumerate(range(0, len(instructions), 10))]
+    pc_to_block = {instruction.pc(): index // 10 for index, instruction in enumerate(instructions)}
+
+    return {"contract": "0x0", "bbs": bbs, "pc_to_block": pc_to_block}
+
+
+def measure(encode, analysis):
+    start = time.perf_counter()
+    encode(analysis)
+    duration = time.perf_counter() - start
+
+    tracemalloc.start()
+    encode(analysis)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return duration, peak
+
+
+if __name__ == "__main__":
+    instruction_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    analysis = synthetic_analysis(instruction_count)
+
+    for name, encode in [("to_json + IntDecoder", round_trip), ("to_document", to_document)]:
+        duration, peak = measure(encode, analysis)
+        print(f"{name:<22} {duration * 1000:8.1f} ms  peak {peak / 2 ** 20:6.1f} MiB")
@@ -0,0 +1,41 @@
+'''
+Measures how long the modules loaded at startup take to import and how much memory they use,
+for the web tier and for workers that also load the analysis modules.
+Every measurement runs in a fresh interpreter.
+
+Run from backend/src: python -m benchmarks.import_time
+'''
+import json
+import subprocess
+import sys
+
+# modules imported by app.py, shared.py and the routes, without connecting to redis and mongodb
+web_modules = ["flask", "flask_cors", "flask_celeryext", "celery", "celery_once", "redis", "pymongo", "gridfs", "etherscan", "web3",
+               "utils", "utils.redis", "utils.codec", "utils.format", "utils.source", "utils.signatures", "utils.information",
+               "utils.disassembly", "datatypes.instructions"]
+# loaded by workers when they run the first analysis
+worker_modules = web_modules + \
+    ["ethpector.analysis", "ethpector.data", "datatypes.json_mapping"]
+
+measure_script = '''
+import importlib, json, resource, sys, time
+start = time.perf_counter()
+for module in sys.argv[1:]:
+    importlib.import_module(module)
+duration = time.perf_counter() - start
+print(json.dumps({"duration": duration, "rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  "mythril": "mythril" in sys.modules, "z3": "z3" in sys.modules}))
+'''
+
+
+def measure(modules, repeat=3):
+    # best of several runs, the first one also pays for reading the files from disk
+    results = [json.loads(subprocess.run([sys.executable, "-c", measure_script, *modules],
+                                         capture_output=True, text=True, check=True).stdout.splitlines()[-1]) for _ in range(repeat)]
+    return min(results, key=lambda result: result["duration"])
+
+
+if __name__ == "__main__":
+    for name, modules in [("web", web_modules), ("worker", worker_modules)]:
+        result = measure(modules)
+        print(f"{name:<8} {result['duration'] * 1000:8.1f} ms  max rss {result['rss'] / 1024:6.1f} MiB  mythril loaded: {result['mythril']}  z3 loaded: {result['z3']}")
@@ -90,3 +90,30 @@ class MythrilConfiguration:
             f"transaction_count={self.transaction_count()}"
             ")"
         )
+
+
+# limits of a mythril run, an analysis with higher limits explores at least the same paths
+mythril_limits = ["execution_timeout", "max_depth", "loop_bound", "create_timeout",
+                  "solver_timeout", "call_depth_limit", "transaction_count"]
+
+
+def normalize_mythril_args(mythril_args=None):
+    '''
+    Mythril arguments with every setting resolved, unset ones take the defaults of the environment.
+    Requests that run the same analysis therefore have equal arguments.
+    '''
+    mythril_args = mythril_args or {}
+    config = MythrilConfiguration(
+        {**mythril_args, "concolic": mythril_args.get("mythril_concolic")})
+
+    normalized = {"mythril_concolic": config.concolic_exec(),
+                  "strategy": config.strategy()}
+    for limit in mythril_limits:
+        normalized[limit] = getattr(config, limit)()
+
+    return normalized
+
+
+def dominates(config, requested):
+    # both configurations are normalized
+    return config["mythril_concolic"] == requested["mythril_concolic"] and config["strategy"] == requested["strategy"] and all(config[limit] >= requested[limit] for limit in mythril_limits)
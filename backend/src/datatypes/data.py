@@ -1,8 +1,12 @@
-from typing import Optional
-from mythril.analysis.ops import Variable
+from __future__ import annotations
+from typing import Optional, TYPE_CHECKING
 import pyevmasm as EVMAsm
 from dataclasses import dataclass
-from ethpector.data.datatypes import SymbolicExpression
+
+if TYPE_CHECKING:
+    # only used in annotations, importing mythril loads z3
+    from mythril.analysis.ops import Variable
+    from ethpector.data.datatypes import SymbolicExpression
 
 
 @dataclass
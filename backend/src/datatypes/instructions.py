@@ -0,0 +1,35 @@
+import pyevmasm as EVMAsm
+from functools import lru_cache
+
+
+@lru_cache(maxsize=256)
+def opcode_fields(opcode):
+    # static pyevmasm fields of an opcode in the stored string format, same fallback as EVMAsm.disassemble_one
+    instruction = EVMAsm.instruction_tables[EVMAsm.DEFAULT_FORK].get(opcode)
+    if instruction is None:
+        instruction = EVMAsm.Instruction(
+            opcode, "INVALID", 0, 0, 0, 0, "Unspecified invalid instruction.")
+
+    return (str(opcode), instruction._name, str(instruction._operand_size), str(instruction._pops), str(instruction._pushes), str(instruction._fee), instruction._description)
+
+
+def compact_instructions(instructions):
+    # parallel arrays of pc, opcode and operand, annotations only for instructions that have some
+    return {
+        "pcs": [int(instruction['instruction']['_pc']) for instruction in instructions],
+        "opcodes": [int(instruction['instruction']['_opcode']) for instruction in instructions],
+        "operands": [instruction['instruction'].get('_operand') for instruction in instructions],
+        "annotations": {str(index): instruction['annotations'] for index, instruction in enumerate(instructions) if len(instruction['annotations']) > 0}
+    }
+
+
+def expand_instructions(columns):
+    # inverse of compact_instructions, the remaining fields are taken from the opcode table
+    instructions = []
+    for index, (pc, opcode, operand) in enumerate(zip(columns['pcs'], columns['opcodes'], columns['operands'])):
+        _opcode, name, operand_size, pops, pushes, fee, description = opcode_fields(
+            opcode)
+        instructions.append({"instruction": {"_opcode": _opcode, "_name": name, "_operand_size": operand_size, "_pops": pops, "_pushes": pushes, "_fee": fee,
+                                             "_description": description, "_operand": str(operand) if operand is not None else None, "_pc": str(pc)}, "annotations": columns['annotations'].get(str(index), [])})
+
+    return instructions
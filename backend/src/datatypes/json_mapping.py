@@ -1,9 +1,41 @@
-from ethpector.data.datatypes import AssemblySummary, ConstantSummary, FunctionEntrypoint, JumpTarget, MetaDataString
+from ethpector.data.datatypes import AssemblySummary, ConstantSummary, FunctionEntrypoint, JumpTarget, MetaDataString, default_json_encoder
 from ethpector.assembly.program import Instruction
 import pyevmasm as EVMAsm
+# compact instruction columns only need the opcode table and are used by the web tier without the analysis types
+from datatypes.instructions import opcode_fields, compact_instructions, expand_instructions
 
 from datatypes.data import ReportedSymbolicVariable, ReportedSymbolicExpression, ReportedSymbolicMemorySlice, ReportedBasicBlocks, ReportedSymbolicExecSummary, FunctionSummary, Call, StorageLoad, StorageWrite, MemoryLoad, MemoryWrite, Log, Return, Revert, Calldataload, Calldatacopy, Selfdestruct, ConditionalJump, UnconditionalJump, Push, SenderConstraintFunction
 
+def document_key(key):
+    # same key conversion as json.dumps
+    if isinstance(key, str):
+        return key
+    if key is True:
+        return "true"
+    if key is False:
+        return "false"
+    if key is None:
+        return "null"
+    return str(key)
+
+
+def to_document(o):
+    '''
+    Converts analysis results to a mongodb document in a single pass.
+    Objects are serialised like ethpector's to_json does, integers are stored as decimal strings
+    because javascript clients lose the precision of values above 2^53 (256 bit words, slots, constants).
+    '''
+    if o is None or isinstance(o, (str, bool, float)):
+        return o
+    if isinstance(o, int):
+        return str(o)
+    if isinstance(o, (list, tuple)):
+        return [to_document(value) for value in o]
+    if isinstance(o, dict):
+        return {document_key(key): to_document(value) for key, value in o.items()}
+
+    return to_document(default_json_encoder(o))
+
 
 def json_to_assembly(json_string):
     # https://github.com/uibk-ethpector/ethpector/blob/570537b28bdd3df99720f8880f0ff6d66244291e/src/ethpector/data/datatypes.py#L1023
@@ -65,8 +97,11 @@ def json_to_basic_blocks(json_string):
 
 def json_to_basic_block(json_string):
     i = json_string['i']
+    stored_instructions = json_string['instructions']
+    if isinstance(stored_instructions, dict):
+        stored_instructions = expand_instructions(stored_instructions)
     instructions = [json_to_instruction(instruction)
-                    for instruction in json_string['instructions']]
+                    for instruction in stored_instructions]
     annotations = json_string['annotations']
     nextBlockIndex = json_string['nextBlockIndex'] if 'nextBlockIndex' in json_string else None
 
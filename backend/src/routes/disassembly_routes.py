@@ -1,74 +1,212 @@
-from flask import Blueprint, request
+from flask import Blueprint, Response, request, make_response
 from shared import app
-from utils.disassembly import add_annotations, add_symbolics, create_block_dict, is_conditional_jump, generate_jumps
-from utils import get_analysis, use_args
-from ethpector.data import AggregateProvider
-from ethpector.data.datatypes import to_json
-from datatypes.json_mapping import json_to_assembly, json_to_basic_blocks, json_to_symbolic
+from utils.disassembly import add_annotations, create_render_data, is_conditional_jump, generate_jumps, bytecode_hash, analysis_key, parts_key, block_documents, collect_subgraph, compact_block, expand_block
+from utils import get_analysis, get_code, use_args
 import json
 from celery_once import QueueOnce
 from shared import celery, redis
 import dataclasses
 from celery_once import AlreadyQueued
-from ethpector.config import Configuration
-from types import SimpleNamespace
-from celery_once.helpers import queue_once_key
-from utils.mongo import Mongo
+from utils.mongo import Mongo, analysis_version
+from datatypes.config import normalize_mythril_args, dominates
+from utils.metrics import metrics
+from utils.progress import publish_progress, progress_events, event_stream, stream_timeout
+from utils.cost import estimate_cost, tier_for_cost, estimated_wait, add_to_backlog, remove_from_backlog, backlog_timeout
+import gzip
+import uuid
 
 
 secret = app.config["CREATE_SECRET"] if "CREATE_SECRET" in app.config else None
 disassembly_route = Blueprint('disassembly', __name__,)
 disassembly_task_name = "get_disassembly"
+symbolic_task_name = "get_symbolic_disassembly"
+static_queue = "light"
+# the load route only needs the precomputed render data of an analysis
+render_projection = {"key": 1, "parts": 1, "stages": 1, "coverage": 1}
+# the windowed routes only need to know which analysis and stage they load
+window_projection = {"key": 1, "parts": 1, "stages": 1}
+# summaries that are only needed to build the render data, they can exceed the document size limit and are not stored
+raw_analysis_keys = ["symbolic_summary",
+                     "disassembly_summary", "bbs", "pc_to_block"]
+# upper bounds for the subgraph endpoints
+max_hops = 5
+max_subgraph_blocks = 500
+# stored analyses only change when their symbolic stage is done, clients and caches revalidate them with the etag
+cache_control = "public, no-cache"
+body_chunk_size = 256 * 1024
+# running analyses of an address by their mythril arguments
+running_prefix = "analysis-running"
 
 
-class IntDecoder(json.JSONDecoder):
-    # Need to decode ints into strings because some integers are too large for mongodb to store
-    def decode(self, s):
-        result = super().decode(s)
-        return self._decode(result)
+def running_key(address):
+    return f"{running_prefix}-{address.lower()}"
 
-    def _decode(self, o):
-        if isinstance(o, int):
-            return str(o)
-        elif isinstance(o, dict):
-            return {k: self._decode(v) for k, v in o.items()}
-        elif isinstance(o, list):
-            return [self._decode(v) for v in o]
-        else:
-            return o
 
+def running_member(mythril_args):
+    return json.dumps(mythril_args, sort_keys=True)
+
+
+def mark_running(address, mythril_args):
+    # kept as long as backlog entries because the symbolic stage may wait hours in the large tier
+    redis.add_expiring(running_key(address),
+                       running_member(mythril_args), backlog_timeout)
+
+
+def running_configs(address):
+    return [json.loads(member) for member in redis.get_members(running_key(address))]
+
+
+def finish_analysis(address, mythril_args, cost, task_id):
+    redis.remove_member(running_key(address), running_member(mythril_args))
+    if cost != None:
+        # the estimate of this analysis no longer adds to the wait of its tier
+        queue, _ = tier_for_cost(cost)
+        remove_from_backlog(redis, queue, task_id, cost)
 
-@celery.task(name=disassembly_task_name, base=QueueOnce, once={'keys': ['address']})
-def get_disassembly(address, args, mythril_args=None):
-    # add task id to redis cache if multiple users load same contract only one task started
-    data = redis.get_routes_from_cache(key=address)
-    if (data is None):
-        try:
-            analysis = get_analysis(address, args, mythril_args)
-        except ValueError as valueError:
-            # not found if valueError
-            return {"task_error": {"message": str(valueError), "status": 404}}
 
-        if (analysis == None):
-            return {"task_error": {"message": "No analysis result", "status": 404}}
+def link_dominating_analysis(address, code, mythril_args):
+    # clones and proxies share their runtime bytecode and therefore the analysis, deeper analyses cover shallower ones
+    if code == None or code == "0x":
+        return False
 
-        if (not type(analysis).__name__ == "CodeAnalysis" and "task_error" in analysis):
-            return analysis
+    code_hash = bytecode_hash(code)
+    mongo = Mongo()
+    analysed = mongo.find_dominating_analysis(
+        code_hash, mythril_args, {"_id": 1}) != None
+    if analysed:
+        mongo.link_address(address, code_hash)
+    mongo.close()
+
+    return analysed
+
+
+# analyses with different mythril arguments may run at the same time
+@celery.task(name=disassembly_task_name, base=QueueOnce, once={'keys': ['address', 'mythril_args']})
+def get_disassembly(address, args, mythril_args=None, cost=None, symbolic_task_id=None):
+    '''
+    Static stage of an analysis, publishes the disassembly within seconds and queues the symbolic execution
+    '''
+    mythril_args = normalize_mythril_args(mythril_args)
+    queued = False
+    try:
+        # add task id to redis cache if multiple users load same contract only one task started
+        if redis.get_routes_from_cache(key=address) != None:
+            return address
 
         try:
+            with metrics.timer("analysis_step_seconds", stage="static", step="code_fetch"):
+                code = get_code(address, args)
+        except Exception:
+            # get_analysis reports missing providers and invalid addresses
+            code = None
+
+        if link_dominating_analysis(address, code, mythril_args):
+            publish_progress(redis, address, "finished",
+                             mythril_args, reused=True)
+            return address
+
+        result = run_disassembly(address, args, mythril_args, code)
+        if result != address:
+            publish_stage_result(address, mythril_args, result)
+        # the static stage is skipped for bytecode whose analysis was finished for a clone in the meantime
+        elif link_dominating_analysis(address, code, mythril_args):
+            publish_progress(redis, address, "finished",
+                             mythril_args, reused=True)
+        else:
+            cost = cost if cost != None else estimate_cost(code, mythril_args)
+            queue, priority = tier_for_cost(cost)
+            get_symbolic_disassembly.apply_async((address, args, mythril_args, code), {"cost": cost},
+                                                 task_id=symbolic_task_id, queue=queue, priority=priority)
+            queued = True
+            publish_progress(redis, address, "static", mythril_args, stages={
+                             "static": True, "symbolic": False}, queue=queue, taskId=symbolic_task_id)
+
+        return result
+    except Exception as exception:
+        publish_progress(redis, address, "failed", mythril_args,
+                         message=str(exception), status=500)
+        raise
+    finally:
+        if not queued:
+            finish_analysis(address, mythril_args, cost, symbolic_task_id)
+
+
+@celery.task(name=symbolic_task_name)
+def get_symbolic_disassembly(address, args, mythril_args, code=None, cost=None):
+    '''
+    Symbolic stage of an analysis, replaces the published disassembly with the annotated one
+    '''
+    # the analysis may have waited in its tier for a long time, it stays marked as running until it is finished
+    mark_running(address, mythril_args)
+    try:
+        result = run_disassembly(
+            address, args, mythril_args, code, symbolic_stage=True)
+        publish_stage_result(address, mythril_args, result)
+        return result
+    except Exception as exception:
+        publish_progress(redis, address, "failed", mythril_args,
+                         message=str(exception), status=500)
+        raise
+    finally:
+        finish_analysis(address, mythril_args, cost,
+                        get_symbolic_disassembly.request.id)
+
+
+def publish_stage_result(address, mythril_args, result):
+    # run_disassembly returns the address once the analysis is stored and the task error otherwise
+    if result == address:
+        publish_progress(redis, address, "finished", mythril_args,
+                         stages={"static": True, "symbolic": True})
+    elif isinstance(result, dict) and "task_error" in result:
+        publish_progress(redis, address, "failed", mythril_args,
+                         **result['task_error'])
+
+
+def run_disassembly(address, args, mythril_args, code, symbolic_stage=False):
+    # the analysis types import mythril, only workers load them
+    from datatypes.json_mapping import to_document
+    from ethpector.data.datatypes import FunctionSummary
+
+    stage = "symbolic" if symbolic_stage else "static"
+
+    def step(name):
+        return metrics.timer("analysis_step_seconds", stage=stage, step=name)
+
+    try:
+        # account summary and CodeAnalysis construction
+        with step("setup"):
+            analysis = get_analysis(address, args, mythril_args, code=code)
+    except ValueError as valueError:
+        # not found if valueError
+        return {"task_error": {"message": str(valueError), "status": 404}}
+
+    if (analysis == None):
+        return {"task_error": {"message": "No analysis result", "status": 404}}
+
+    if (not type(analysis).__name__ == "CodeAnalysis" and "task_error" in analysis):
+        return analysis
+
+    try:
+        with step("basic_blocks"):
             bbs = analysis.aa.get_basic_blocks()
-            symbolic = analysis.sa
-            disassembly = analysis.aa
-        except ValueError:
-            # values missing in get summary therefore throwing value error
-            return {"task_error": {"message": "No values in analysis", "status": 500}}
+        symbolic = analysis.sa
+        disassembly = analysis.aa
+    except ValueError:
+        # values missing in get summary therefore throwing value error
+        return {"task_error": {"message": "No values in analysis", "status": 500}}
 
-        try:
+    try:
+        with step("disassembly_summary"):
             disassembly_summary = disassembly.get_summary()
-            symbolic_summary = symbolic.get_summary()
-        except Exception as exception:
-            return {"task_error": {"message": f"Ethpector analysis summaries failed with the following exception: {exception}", "status": 500}}
-
+        # the static stage only needs the disassembly, mythril runs in the symbolic stage
+        symbolic_summary = None
+        if symbolic_stage:
+            with step("symbolic_summary"):
+                symbolic_summary = symbolic.get_summary()
+    except Exception as exception:
+        return {"task_error": {"message": f"Ethpector analysis summaries failed with the following exception: {exception}", "status": 500}}
+
+    with step("annotations"):
         links = []
         pc_to_block = {}
         # adding annotations
@@ -95,16 +233,46 @@ def get_disassembly(address, args, mythril_args=None):
                     annotation).__name__, "data": annotation} for annotation in inst.annotations]
 
         # adding entrypoint to functions
-        found_functions = symbolic_summary.functions
-        functions = [{"entrypoint": entrypoint_by_function(
-            _function, disassembly_summary.function_entrypoints, pc_to_block), "function": dataclasses.asdict(_function)} for _function in found_functions]
-
-        data = to_json({"contract": address, "symbolic_summary": symbolic_summary,
-                       "disassembly_summary": disassembly_summary, "bbs": bbs, "links": links, "pc_to_block": pc_to_block, "functions": functions})
-        # saving result in mongodb at the end
-        mongo = Mongo()
-        mongo.db['contracts'].insert_one(json.loads(data, cls=IntDecoder))
+        if symbolic_summary != None:
+            found_functions = symbolic_summary.functions
+            functions = [{"entrypoint": entrypoint_by_function(
+                _function, disassembly_summary.function_entrypoints, pc_to_block), "function": dataclasses.asdict(_function)} for _function in found_functions]
+        else:
+            # until the symbolic stage is done functions are only known by their entrypoints
+            functions = [{"entrypoint": {"block": pc_to_block[entrypoint.pc], "functionName": entrypoint.function_name}, "function": dataclasses.asdict(FunctionSummary(
+                entrypoint.function_name))} for entrypoint in disassembly_summary.function_entrypoints if entrypoint.pc in pc_to_block]
+
+    code_hash = bytecode_hash(analysis.get_bytecode())
+    key = analysis_key(code_hash, mythril_args)
+    parts = parts_key(key)
+    stages = {"static": True, "symbolic": symbolic_summary != None}
+    with step("to_document"):
+        analysis_document = to_document({"contract": address, "code_hash": code_hash, "key": key, "parts": parts, "stages": stages, "symbolic_summary": symbolic_summary,
+                                     "disassembly_summary": disassembly_summary, "bbs": bbs, "links": links, "pc_to_block": pc_to_block, "functions": functions})
+    # the mythril limits stay numbers so that dominating analyses can be queried
+    analysis_document['config'] = mythril_args
+    # blocks and coverage never change after the analysis so the load route can return them as is
+    with step("render_data"):
+        render_data = create_render_data(analysis_document)
+    analysis_document['coverage'] = render_data['coverage']
+    analysis_document['block_count'] = len(render_data['blocks'])
+    blocks = block_documents(parts, [compact_block(
+        block) for block in render_data['blocks']], analysis_document.pop('links'))
+    functions = analysis_document.pop('functions')
+    for part in raw_analysis_keys:
+        analysis_document.pop(part)
+    # saving result in mongodb at the end
+    mongo = Mongo()
+    if not symbolic_stage and mongo.find_dominating_analysis(code_hash, mythril_args, {"_id": 1}) != None:
+        # an analysis of a clone finished in the meantime, it must not be replaced by the static stage
+        mongo.link_address(address, code_hash)
         mongo.close()
+        return address
+
+    # the compressed body is written together with the other parts before the document points to them
+    with step("save"):
+        mongo.save_analysis(address, code_hash, analysis_document, blocks,
+                            functions, lambda document: save_compressed_body(mongo, document))
 
     return address
 
@@ -128,6 +296,54 @@ def entrypoint_by_function(_function, entrypoints, pc_to_block):
         return None
 
 
+def save_compressed_body(mongo, data):
+    # the load response is compressed once by the worker instead of on every request
+    with mongo.new_compressed_body(data['parts']) as body:
+        with gzip.GzipFile(fileobj=body, mode="wb") as compressed:
+            for piece in stream_analysis(mongo, data):
+                compressed.write(piece.encode("utf-8"))
+
+
+def analysis_etag(data, compressed=False):
+    # every stored stage has its own parts, the symbolic stage changes the etag of the static disassembly
+    # the precompressed body is a different representation and needs its own strong etag
+    etag = f"{data['parts']}-{analysis_version}"
+    return f"{etag}-gzip" if compressed else etag
+
+
+def not_modified(data):
+    # response for clients that already have the analysis in either encoding, None if they need it
+    for compressed in [False, True]:
+        etag = analysis_etag(data, compressed)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = cache_control
+            response.vary.add("Accept-Encoding")
+            return response
+
+    return None
+
+
+def immutable_response(response, data, compressed=False):
+    response = make_response(response)
+    response.set_etag(analysis_etag(data, compressed))
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def compressed_response(mongo, data):
+    body = mongo.find_compressed_body(data['parts'])
+    if body == None:
+        return None
+
+    response = Response(iter(lambda: body.read(body_chunk_size), b""),
+                        mimetype="application/json")
+    response.headers['Content-Encoding'] = "gzip"
+    response.headers['Content-Length'] = str(body.length)
+    return response
+
+
 @disassembly_route.route("/load/<address>")
 def load_analysis(address):
     '''
@@ -136,74 +352,232 @@ def load_analysis(address):
     '''
 
     mongo = Mongo()
-    data = mongo.db['contracts'].find_one({"contract": address})
-    mongo.close()
+    data = mongo.find_analysis(address, render_projection)
 
     if data == None:
 
         token = request.args.get('etherscan')
         rpc = request.args.get('rpc')
 
-        config = Configuration(SimpleNamespace(**use_args(
-            etherscan_token=token, ethpector_rpc=rpc)))
-
-        online_resolver = AggregateProvider(config)
         try:
-            code = online_resolver.first_of(
-                ["node", "etherscan"]).get_code(address)
+            code = get_code(address, use_args(
+                etherscan_token=token, ethpector_rpc=rpc))
         except Exception as ex:
+            mongo.close()
             return {"type": 0, "message": str(ex)}, 400
 
         # invalid addresses have no code and external account addresses or selfdestructed contracts have 0x as code and cannot be analysed
         if code == "0x":
+            mongo.close()
             return {"type": 1, "message": "No bytecode at address"}, 404
 
         if code == None:
+            mongo.close()
             return {"type": 1, "message": "Not a valid address"}, 400
 
-        # if celery once key is found we now a task is still running
-        key = queue_once_key(disassembly_task_name, {"address": address, "args": use_args(
-            etherscan_token=token, ethpector_rpc=rpc)}, ["address"])
-        if redis.get_routes_from_cache(key) != None:
+        # same bytecode may already be analysed under a different address
+        code_hash = bytecode_hash(code)
+        data = mongo.find_analysis_by_hash(code_hash, render_projection)
+        if data != None:
+            mongo.link_address(address, code_hash)
+
+    if data == None:
+        mongo.close()
+        # tasks of every mythril configuration are tracked until they are finished
+        if len(running_configs(address)) > 0:
             return {"state": 2}
 
         return {"state": 1}
 
-    disassembly_summary = json_to_assembly(data['disassembly_summary'])
-    symbolic_summary = json_to_symbolic(data['symbolic_summary'])
-    bbs = json_to_basic_blocks(data['bbs'])
-    links = data['links']
-    pc_to_block = {int(k): int(v) for k, v in data['pc_to_block'].items()}
+    unchanged = not_modified(data)
+    if unchanged != None:
+        mongo.close()
+        return unchanged
+
+    response = None
+    if request.accept_encodings['gzip'] > 0:
+        response = compressed_response(mongo, data)
+    compressed = response != None
+    if response == None:
+        response = Response(stream_analysis(
+            mongo, data), mimetype="application/json")
+    response.vary.add("Accept-Encoding")
+
+    return immutable_response(response, data, compressed)
+
+
+def json_array(items):
+    yield "["
+    for index, item in enumerate(items):
+        yield ("," if index > 0 else "") + json.dumps(item)
+    yield "]"
+
+
+def stream_analysis(mongo, data):
+    '''
+    Writes the load response piece by piece from the block and function documents
+    so that analyses of any size are never held in memory as a whole
+    '''
+    key = data['parts']
+    try:
+        yield '{"blocks": '
+        yield from json_array(expand_block(document['block']) for document in mongo.find_blocks(key, projection={"block": 1}))
+        yield ', "links": '
+        yield from json_array(link for document in mongo.find_blocks(key, projection={"links": 1}) for link in document['links'])
+        yield ', "functions": '
+        yield from json_array(mongo.find_functions(key))
+        yield ', "coverage": ' + json.dumps(data['coverage'])
+        yield ', "stages": ' + json.dumps(data['stages']) + '}'
+    finally:
+        mongo.close()
+
+
+def parse_int_arg(name, default):
+    value = request.args.get(name)
+    if value == None:
+        return default
+
+    return int(value)
 
-    blocks = []
 
-    # create dict that maps all instructions to each block
-    for _id, bb in enumerate(bbs):
-        block_dict = create_block_dict(_id, bb)
+@disassembly_route.route("/load/<address>/blocks")
+def load_block_range(address):
+    '''
+    Loads the blocks with start <= index < end together with their outgoing links
+    '''
+
+    try:
+        start = parse_int_arg('start', 0)
+        end = parse_int_arg('end', start + max_subgraph_blocks)
+    except ValueError:
+        return {"message": "Invalid block range given", "type": 10}, 400
+
+    end = min(end, start + max_subgraph_blocks)
+
+    mongo = Mongo()
+    data = mongo.find_analysis(address, {**window_projection, "block_count": 1})
+
+    if data == None:
+        mongo.close()
+        return "No analysis result", 404
+
+    unchanged = not_modified(data)
+    if unchanged != None:
+        mongo.close()
+        return unchanged
+
+    documents = list(mongo.find_blocks(
+        data['parts'], {"i": {"$gte": start, "$lt": end}}))
+    mongo.close()
+
+    return immutable_response({"blocks": [expand_block(document['block']) for document in documents], "links": [link for document in documents for link in document['links']], "total": data['block_count'], "stages": data['stages']}, data)
+
+
+@disassembly_route.route("/load/<address>/function/<int:index>")
+def load_function(address, index):
+    '''
+    Loads the subgraph reachable from the entrypoint block of a function in the functions list
+    '''
+
+    mongo = Mongo()
+    data = mongo.find_analysis(address, window_projection)
+
+    if data == None:
+        mongo.close()
+        return "No analysis result", 404
+
+    unchanged = not_modified(data)
+    if unchanged != None:
+        mongo.close()
+        return unchanged
+
+    function = mongo.find_function(data['parts'], index)
+
+    if function == None or function['entrypoint'] == None:
+        mongo.close()
+        return "No entrypoint for function", 404
+
+    entrypoint = int(function['entrypoint']['block'])
+    subgraph = collect_subgraph(entrypoint, lambda ids: mongo.find_blocks(
+        data['parts'], {"i": {"$in": ids}}), None, max_subgraph_blocks, backwards=False)
+    mongo.close()
+
+    subgraph['blocks'] = [expand_block(block) for block in subgraph['blocks']]
+    subgraph['function'] = function
+    subgraph['stages'] = data['stages']
 
-        blocks.append(block_dict)
+    return immutable_response(subgraph, data)
 
-    add_symbolics(symbolic_summary, blocks, pc_to_block)
 
-    # calculate coverage
-    ac = (
-        (int(disassembly_summary.unique_instructions_visited) /
-         int(disassembly_summary.total_instructions))
-        if int(disassembly_summary.total_instructions) > 0
-        else 0
-    )
-    sc = (
-        (int(symbolic_summary.unique_instructions_visited) /
-         int(disassembly_summary.total_instructions))
-        if int(disassembly_summary.total_instructions) > 0
-        else 0
-    )
-    coverage = {"assembly": ac, "symbolic": sc}
+@disassembly_route.route("/load/<address>/neighborhood/<int:block>")
+def load_neighborhood(address, block):
+    '''
+    Loads all blocks that are at most hops links away from the given block in either direction
+    '''
+
+    try:
+        hops = min(parse_int_arg('hops', 1), max_hops)
+    except ValueError:
+        return {"message": "Invalid hops value given", "type": 10}, 400
+
+    mongo = Mongo()
+    data = mongo.find_analysis(address, window_projection)
+
+    if data == None:
+        mongo.close()
+        return "No analysis result", 404
+
+    unchanged = not_modified(data)
+    if unchanged != None:
+        mongo.close()
+        return unchanged
+
+    subgraph = collect_subgraph(block, lambda ids: mongo.find_blocks(
+        data['parts'], {"i": {"$in": ids}}), hops, max_subgraph_blocks)
+    mongo.close()
+
+    subgraph['blocks'] = [expand_block(block) for block in subgraph['blocks']]
+    subgraph['stages'] = data['stages']
+
+    return immutable_response(subgraph, data)
+
 
-    data = {"blocks": blocks, "links":
-            links, "functions": data['functions'], "coverage": coverage}
+@disassembly_route.route("/events/<address>")
+def analysis_events(address):
+    '''
+    Server sent events of the analyses of an address: queued, static, finished and failed
+    The stream is closed after a finished or failed event or after stream_timeout seconds, EventSource then reconnects with the id of the last event
+    '''
+    events = progress_events(
+        redis, address, request.headers.get('Last-Event-ID'))
+    response = Response(event_stream(events), mimetype="text/event-stream")
+    response.headers['Cache-Control'] = "no-cache"
+    # nginx would otherwise buffer the stream
+    response.headers['X-Accel-Buffering'] = "no"
+    return response
+
+
+@disassembly_route.route("/progress/<address>")
+def analysis_progress(address):
+    '''
+    Long polling fallback for clients without EventSource, returns the first event after the given id
+    or 204 if nothing happened within the wait time
+    '''
+    try:
+        wait = min(parse_int_arg('wait', stream_timeout), stream_timeout)
+    except ValueError:
+        return {"message": "Invalid wait value given", "type": 10}, 400
+
+    events = progress_events(redis, address, request.args.get('after'), wait)
+    try:
+        event = next((event for event in events if event != None), None)
+    finally:
+        events.close()
+
+    if event == None:
+        return "", 204
 
-    return data
+    return event
 
 
 @disassembly_route.route("/<address>")
@@ -232,17 +606,45 @@ def analyse_disassembly(address):
     except (ValueError, TypeError):
         solver_timeout = None
 
-    mythril_args = {
+    mythril_args = normalize_mythril_args({
         "execution_timeout": execution_timeout,
         "create_timeout": create_timeout,
         "max_depth": max_depth,
         "solver_timeout": solver_timeout
-    }
+    })
+
+    args = use_args(etherscan_token=token, ethpector_rpc=rpc)
+
+    try:
+        code = get_code(address, args)
+    except Exception:
+        # the task reports invalid addresses, without bytecode the mythril timeouts are the estimate
+        code = None
+
+    # a stored or running analysis with at least the requested limits is used instead of a new one
+    if link_dominating_analysis(address, code, mythril_args):
+        return {"state": 3, "reused": True, "estimatedWait": 0}, 200
+
+    if any(dominates(config, mythril_args) for config in running_configs(address)):
+        return {"state": 2}, 200
 
+    cost = estimate_cost(code if code != "0x" else None, mythril_args)
+    queue, _ = tier_for_cost(cost)
+    wait = estimated_wait(redis, queue, cost)
+
+    # the estimate is added before queueing because the symbolic stage removes it when it is finished
+    symbolic_task_id = str(uuid.uuid4())
+    add_to_backlog(redis, queue, symbolic_task_id, cost)
+    mark_running(address, mythril_args)
+    # published before queueing so it never replaces an event of the task as the latest one
+    publish_progress(redis, address, "queued", mythril_args,
+                     queue=queue, estimatedWait=wait)
     try:
-        get_disassembly.delay(address, use_args(
-            etherscan_token=token, ethpector_rpc=rpc), mythril_args)
+        # the static stage is short and does not wait behind other analyses, it queues the symbolic stage in the tier of the analysis
+        get_disassembly.apply_async((address, args, mythril_args), {"cost": cost, "symbolic_task_id": symbolic_task_id},
+                                    queue=static_queue)
     except AlreadyQueued:
+        remove_from_backlog(redis, queue, symbolic_task_id, cost)
         return {"state": 2}, 200
 
-    return {"state": 3}, 200
+    return {"state": 3, "queue": queue, "estimatedCost": cost, "estimatedWait": wait}, 200
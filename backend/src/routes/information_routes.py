@@ -1,16 +1,15 @@
 from flask import Blueprint, request
-from ethpector.data import AggregateProvider
 from types import SimpleNamespace
-from ethpector.config import Configuration
-from utils.information import etherscan_transactions, etherscan_contract_creation, decode_transactions, retrieve_events, decode_events
-from shared import redis
+from utils.information import transaction_history, transactions_before, internal_transactions_before, parse_cursor, next_cursor, next_internal_cursor, page_size, etherscan_contract_creation, decode_transactions, retrieve_events, decode_events, submit_upstream, upstream_result, upstream_timeout, log_scan_timeout, UpstreamTimeout
+from shared import redis, immutable_cache, celery
 from utils.format import format_transactions, str_timestamp_to_date
 from etherscan import Etherscan
 from web3 import Web3
-from utils.redis import ttl
+from utils.redis import single_flight, cached_value, refresh_entry
+import threading
 from utils import use_args
+from utils.mongo import Mongo
 import json
-from decimal import Decimal
 
 max_blocks = 1000000
 starting_max = 10000
@@ -19,6 +18,9 @@ information_route = Blueprint('information', __name__,)
 
 
 def extract_account_summary(address, etherscan_token, ethpector_rpc):
+    # ethpector.data imports mythril, it is only loaded once the first summary is not cached
+    from ethpector.data import AggregateProvider
+    from ethpector.config import Configuration
 
     config = Configuration(SimpleNamespace(**use_args(
         etherscan_token=etherscan_token, ethpector_rpc=ethpector_rpc)))
@@ -40,27 +42,117 @@ def is_valid_address(account_summary):
     return account_summary.__class__.__name__ == "AccountSummary" or "task_error" not in account_summary
 
 
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            return str(obj)
+class InformationContext(object):
+    '''
+    Upstream lookups of one request shared by all information sections.
+    Each lookup is started at most once, the first section that needs it starts it and later ones wait for the same result.
+    '''
+
+    def __init__(self, address, token, rpc, cursor=None, internal_cursor=None):
+        self.address = address
+        self.token = token
+        self.rpc = rpc
+        # pages after the cursors instead of the most recent items
+        self.cursor = cursor
+        self.internal_cursor = internal_cursor
+        self.paged = cursor != None or internal_cursor != None
+        self.eth = Etherscan(token) if token is not None else Etherscan('')
+        self.web3prov = Web3(Web3.HTTPProvider(
+            rpc, request_kwargs={"timeout": upstream_timeout}))
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.is_contract = None
+
+    def lookup(self, name):
+        return {
+            "account_summary": lambda: extract_account_summary(self.address, self.token, self.rpc),
+            "balance": lambda: self.eth.get_eth_balance(address=self.address),
+            "source": lambda: self.eth.get_contract_source_code(address=self.address),
+            "creation": lambda: etherscan_contract_creation(self.token, self.address, self.eth, immutable_cache),
+            "transactions": self.transactions,
+            "events": lambda: retrieve_events(self.web3prov, self.address, self.eth, max_blocks, starting_max, before=self.cursor),
+        }[name]
+
+    def transactions(self):
+        if not self.paged:
+            return transaction_history(self.address, self.eth, max_blocks, Mongo())
+
+        # a missing cursor means that list has no more pages
+        txs = transactions_before(
+            self.address, self.eth, self.cursor, max_blocks) if self.cursor != None else []
+        int_txs = internal_transactions_before(
+            self.address, self.eth, self.internal_cursor, max_blocks) if self.internal_cursor != None else []
+        return (txs, int_txs)
+
+    def key(self, section):
+        return page_key(self.address, section, self.cursor, self.internal_cursor)
+
+    def start(self, names):
+        # independent lookups run concurrently
+        with self.lock:
+            missing = {name: self.lookup(name)
+                       for name in names if name not in self.calls}
+            self.calls.update(submit_upstream(missing))
+
+    def result(self, name, timeout=upstream_timeout):
+        self.start([name])
+        return upstream_result(self.calls[name], timeout)
+
+    def start_sections(self, sections):
+        '''
+        Resolves the account summary and starts the lookups the sections need for this kind of account.
+        Nothing else is started for invalid addresses, returns the account summary or its task error.
+        '''
+        account_summary = self.result("account_summary")
+        if not is_valid_address(account_summary):
+            return account_summary
+
+        self.is_contract = account_summary.is_contract
+        kind = "contract" if self.is_contract else "external"
+        self.start([name for section in sections for name in section_lookups[section][kind]])
+        return account_summary
+
+    def abi(self):
+        # external accounts have no source code
+        if not self.is_contract:
+            return None
 
-        return json.JSONEncoder.default(self, obj)
+        try:
+            return json.loads(self.result("source")[0]['ABI'])
+        except UpstreamTimeout:
+            raise
+        except:
+            return None
 
 
-@information_route.route("/basic/<address>")
-def get_information(address):
-    cache_key = f"{address}-information-basic"
+# upstream lookups of each section after the account summary, external accounts skip the contract lookups
+# selfdestructed contracts are external accounts that still have logs
+section_lookups = {
+    "basic": {"contract": ["balance", "source", "creation"], "external": []},
+    "transactions": {"contract": ["source", "transactions"], "external": ["transactions"]},
+    "events": {"contract": ["source", "events"], "external": ["events"]},
+}
 
-    data = redis.get_routes_from_cache(cache_key)
 
-    if data != None:
-        return json.loads(data)
+def cache_key(address, section):
+    return f"{address}-information-{section}"
 
-    token = request.args.get('etherscan')
-    rpc = request.args.get('rpc')
 
-    account_summary = extract_account_summary(address, token, rpc)
+def page_key(address, section, cursor=None, internal_cursor=None):
+    if cursor == None and internal_cursor == None:
+        return cache_key(address, section)
+
+    # each page is cached on its own
+    cursors = [f"{block}-{index}" if block != None else "end" for block,
+               index in [cursor or (None, None), internal_cursor or (None, None)]]
+    return f"{cache_key(address, section)}-{'-'.join(cursors)}"
+
+
+def basic_section(context):
+    try:
+        account_summary = context.start_sections(["basic"])
+    except UpstreamTimeout:
+        return "Upstream request timed out", 504
 
     if not is_valid_address(account_summary):
         return account_summary['task_error'], account_summary['task_error']['status']
@@ -72,17 +164,14 @@ def get_information(address):
         }
         return data
 
-    if token is not None:
-        eth = Etherscan(token)
-    else:
-        eth = Etherscan('')
     try:
 
-        balance = eth.get_eth_balance(address=address)
-        source = eth.get_contract_source_code(address=address)
+        balance = context.result("balance")
+        source = context.result("source")
 
-        transaction, creator, contract_timestamp = etherscan_contract_creation(
-            token, address, eth)
+        transaction, creator, contract_timestamp = context.result("creation")
+    except UpstreamTimeout:
+        return "Upstream request timed out", 504
     except AssertionError as assertError:
         return str(assertError), 404
     except Exception as error:
@@ -97,114 +186,207 @@ def get_information(address):
         "creationDate": str_timestamp_to_date(contract_timestamp),
     }
 
-    redis.set_routes_to_cache(cache_key, value=json.dumps(
-        data, cls=DecimalEncoder), ttl=ttl)
+    redis.set_fresh_to_cache(cache_key(context.address, "basic"), data)
 
     return data
 
 
-@information_route.route("/transactions/<address>")
-def get_transactions(address):
-    cache_key = f"{address}-information-transactions"
+def transactions_section(context):
+    try:
+        account_summary = context.start_sections(["transactions"])
+    except UpstreamTimeout:
+        return "Upstream request timed out", 504
 
-    data = redis.get_routes_from_cache(cache_key)
+    if not is_valid_address(account_summary):
+        return account_summary['task_error'], account_summary['task_error']['status']
 
-    if data != None:
-        return json.loads(data)
+    try:
 
-    token = request.args.get('etherscan')
-    rpc = request.args.get('rpc')
+        txs, int_txs = context.result("transactions")
 
-    account_summary = extract_account_summary(address, token, rpc)
+        tx_limited = txs[:page_size]
+        int_tx_limited = int_txs[:page_size]
 
-    if not is_valid_address(account_summary):
-        return account_summary['task_error'], account_summary['task_error']['status']
+        cursor = next_cursor(tx_limited, 'transactionIndex')
+        internal_cursor = next_internal_cursor(
+            int_tx_limited, context.internal_cursor)
 
-    if token is not None:
-        eth = Etherscan(token)
-    else:
-        eth = Etherscan('')
+        decode_transactions(context.web3prov, context.address,
+                            tx_limited, abi=context.abi())
 
-    source = eth.get_contract_source_code(address=address)
+        data = {
+            "normalTransactions": format_transactions(tx_limited),
+            "internalTransactions": format_transactions(int_tx_limited),
+            "nextCursor": cursor,
+            "nextInternalCursor": internal_cursor,
+        }
+
+        redis.set_fresh_to_cache(context.key("transactions"), data)
 
+        return data
+    except UpstreamTimeout:
+        return "Upstream request timed out", 504
+    except AssertionError as assertError:
+        return str(assertError), 404
+    except Exception as error:
+        return str(error), 500
+
+
+def events_section(context):
     try:
+        account_summary = context.start_sections(["events"])
+    except UpstreamTimeout:
+        return "Upstream request timed out", 504
 
-        txs, int_txs = etherscan_transactions(address, eth, max_blocks)
+    if not is_valid_address(account_summary):
+        return account_summary['task_error'], account_summary['task_error']['status']
 
-        tx_limited = txs[:50]
-        int_tx_limited = int_txs[:50]
+    try:
 
-        try:
-            source_abi = json.loads(source[0]['ABI'])
-        except:
-            source_abi = None
+        source_abi = context.abi()
 
-        web3prov = Web3(Web3.HTTPProvider(rpc))
+        logs = context.result("events", log_scan_timeout)
 
-        decode_transactions(web3prov, address, tx_limited, abi=source_abi)
+        events = decode_events(
+            context.web3prov, context.address, logs, source_abi, immutable_cache)
 
         data = {
-            "normalTransactions": format_transactions(tx_limited),
-            "internalTransactions": format_transactions(int_tx_limited),
+            "events": events,
+            "nextCursor": next_cursor(logs, 'logIndex'),
         }
 
-        redis.set_routes_to_cache(cache_key, value=json.dumps(
-            data, cls=DecimalEncoder), ttl=ttl)
+        redis.set_fresh_to_cache(context.key("events"), data)
 
         return data
+    except UpstreamTimeout:
+        return "Upstream request timed out", 504
     except AssertionError as assertError:
         return str(assertError), 404
     except Exception as error:
         return str(error), 500
 
 
-@information_route.route("/events/<address>")
-def get_events(address):
-    cache_key = f"{address}-information-events"
+sections = {
+    "basic": basic_section,
+    "transactions": transactions_section,
+    "events": events_section,
+}
+
+
+def compute_section(address, section, token, rpc):
+    return sections[section](InformationContext(address, token, rpc))
+
 
-    data = redis.get_routes_from_cache(cache_key)
+@celery.task(name="refresh_information", queue="light")
+def refresh_information(address, section, token, rpc):
+    refresh_entry(redis, cache_key(address, section),
+                  lambda: compute_section(address, section, token, rpc))
 
-    if data != None:
-        return json.loads(data)
 
+def load_section(address, section):
     token = request.args.get('etherscan')
     rpc = request.args.get('rpc')
 
-    account_summary = extract_account_summary(address, token, rpc)
+    return single_flight(redis, cache_key(address, section), lambda: compute_section(address, section, token, rpc),
+                         lambda: refresh_information.delay(address, section, token, rpc))
 
-    if not is_valid_address(account_summary):
-        return account_summary['task_error'], account_summary['task_error']['status']
 
-    if token is not None:
-        eth = Etherscan(token)
-    else:
-        eth = Etherscan('')
+@information_route.route("/basic/<address>")
+def get_information(address):
+    return load_section(address, "basic")
+
+
+def parse_cursor_arg(name):
+    value = request.args.get(name)
+    if value == None:
+        return None
+
+    return parse_cursor(value)
+
+
+def load_page(address, section, cursor, internal_cursor=None):
+    '''
+    Loads the items after the cursors, the first page is the regular section
+    '''
+    if cursor == None and internal_cursor == None:
+        return load_section(address, section)
+
+    token = request.args.get('etherscan')
+    rpc = request.args.get('rpc')
+
+    def compute():
+        return sections[section](InformationContext(
+            address, token, rpc, cursor, internal_cursor))
+
+    # older pages only change with reorgs so they are not refreshed
+    return single_flight(redis, page_key(address, section, cursor, internal_cursor), compute)
+
+
+@information_route.route("/transactions/<address>")
+def get_transactions(address):
+    '''
+    Loads the most recent transactions or the page after the cursor and internalCursor arguments
+    '''
 
     try:
+        cursor = parse_cursor_arg('cursor')
+        internal_cursor = parse_cursor_arg('internalCursor')
+    except ValueError:
+        return {"message": "Invalid cursor given", "type": 10}, 400
 
-        source = eth.get_contract_source_code(address=address)
+    return load_page(address, "transactions", cursor, internal_cursor)
 
-        try:
-            source_abi = json.loads(source[0]['ABI'])
-        except:
-            source_abi = None
 
-        web3prov = Web3(Web3.HTTPProvider(rpc))
+@information_route.route("/events/<address>")
+def get_events(address):
+    '''
+    Loads the most recent events or the page after the cursor argument
+    '''
 
-        events = retrieve_events(
-            web3prov, address, eth, max_blocks, starting_max)
+    try:
+        cursor = parse_cursor_arg('cursor')
+    except ValueError:
+        return {"message": "Invalid cursor given", "type": 10}, 400
 
-        events = decode_events(web3prov, address, events, source_abi)
+    return load_page(address, "events", cursor)
 
-        data = {
-            "events": events
-        }
 
-        redis.set_routes_to_cache(cache_key, value=json.dumps(
-            data, cls=DecimalEncoder), ttl=ttl)
+@information_route.route("/overview/<address>")
+def get_overview(address):
+    '''
+    Loads all information sections at once, sections that are not cached share the upstream lookups
+    Sections that failed contain their error message and status
+    '''
 
-        return data
-    except AssertionError as assertError:
-        return str(assertError), 404
-    except Exception as error:
-        return str(error), 500
+    token = request.args.get('etherscan')
+    rpc = request.args.get('rpc')
+
+    overview = {}
+    missing = []
+    for section in sections:
+        data = cached_value(redis, cache_key(address, section),
+                            lambda: refresh_information.delay(address, section, token, rpc))
+        if data != None:
+            overview[section] = data
+        else:
+            missing.append(section)
+
+    if len(missing) > 0:
+        context = InformationContext(address, token, rpc)
+        try:
+            # the lookups of all missing sections run at the same time
+            context.start_sections(missing)
+        except UpstreamTimeout:
+            # reported by every section
+            pass
+
+        for section in missing:
+            result = single_flight(redis, cache_key(address, section),
+                                   lambda: sections[section](context))
+            if isinstance(result, tuple):
+                message, status = result[:2]
+                overview[section] = {"error": message, "status": status}
+            else:
+                overview[section] = result
+
+    return overview
@@ -1,7 +1,6 @@
 import os
 from flask import Blueprint, request
-from ethpector.data.signatures import SignatureProvider
-from ethpector.data.node import NodeProvider
+from utils.signatures import signature_cache
 import json
 
 
@@ -9,11 +8,11 @@ lookup_route = Blueprint('lookup', __name__,)
 
 disassembly_task_name = "get_disassembly"
 
-signature_provider = SignatureProvider()
-
 
 @lookup_route.route("/storage/<address>")
 def storage_lookup(address):
+    # the ethpector.data package imports mythril
+    from ethpector.data.node import NodeProvider
 
     rpc = request.args.get('rpc')
         
@@ -41,7 +40,7 @@ def event_lookup(event):
     signature = None
 
     try:
-        matches = signature_provider.event_name(hex(int(event,0)))
+        matches = signature_cache.event_name(hex(int(event,0)))
         if (len(matches) > 0):
             signature = " or ".join(matches)
     except ValueError:
@@ -1,7 +1,19 @@
-from utils.redis import Redis
+from utils.redis import Redis, ImmutableCache
 from utils import celery_ext, create_app
+from utils.signatures import signature_cache
+from utils.metrics import metrics
+import os
 
 redis = Redis()
+immutable_cache = ImmutableCache(redis)
+signature_cache.redis = redis
+metrics.redis = redis
+if os.environ.get("SIGNATURE_DUMP"):
+    try:
+        print(
+            f"loaded {signature_cache.prewarm(os.environ.get('SIGNATURE_DUMP'))} signatures")
+    except Exception as exception:
+        print(f"loading signature dump failed with following error: {exception}")
 app = create_app()
 celery = celery_ext.celery
 inspect = celery.control.inspect()
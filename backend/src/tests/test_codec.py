@@ -0,0 +1,28 @@
+from utils.codec import ZlibCodec, ZstdCodec, decode
+from decimal import Decimal
+import json
+
+value = {"events": [{"signature": "Transfer(address,address,uint256)", "unindexedValues": [{"value": 2 ** 200}], "indexedValues": [{"from": "0xaf64d797f9c2364ad614476188d5ac9443812f99"}]}] * 20,
+         "balance": Decimal("1.000000000000000001"), "nextCursor": None}
+# decimals are stored as strings like the routes return them
+decoded = {**value, "balance": "1.000000000000000001"}
+
+
+def test_zstd_round_trip():
+    encoded = ZstdCodec().encode(value)
+
+    assert encoded[0] == 2
+    assert decode(encoded) == decoded
+    assert len(encoded) < len(json.dumps(decoded)) / 5
+
+
+def test_zlib_round_trip():
+    encoded = ZlibCodec().encode(value)
+
+    assert encoded[0] == 1
+    assert decode(encoded) == decoded
+
+
+def test_plain_json_entries():
+    assert decode(b'{"events": []}') == {"events": []}
+    assert decode(None) == None
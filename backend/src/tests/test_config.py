@@ -0,0 +1,33 @@
+from datatypes.config import normalize_mythril_args, dominates
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def default_environment(monkeypatch):
+    for name in ["EXECUTION_TIMEOUT", "MAX_DEPTH", "STRATEGY", "CONCOLICEXEC"]:
+        monkeypatch.delenv(f"ETHPECTOR_MYTHRIL_{name}", raising=False)
+
+
+def test_normalize_mythril_args():
+    normalized = normalize_mythril_args(
+        {"execution_timeout": None, "max_depth": 256})
+
+    assert normalized == normalize_mythril_args(
+        {"execution_timeout": 30, "max_depth": 256})
+    assert normalized["max_depth"] == 256
+    assert normalized["strategy"] == "bfs"
+    # normalizing twice changes nothing
+    assert normalize_mythril_args(normalized) == normalized
+
+
+def test_dominates():
+    shallow = normalize_mythril_args({})
+    deep = normalize_mythril_args({"execution_timeout": 600, "max_depth": 512})
+    long = normalize_mythril_args({"execution_timeout": 600, "max_depth": 64})
+
+    assert dominates(deep, shallow)
+    assert not dominates(shallow, deep)
+    assert dominates(deep, deep)
+    # incomparable limits
+    assert not dominates(long, shallow) and not dominates(shallow, long)
+    assert not dominates({**deep, "strategy": "dfs"}, shallow)
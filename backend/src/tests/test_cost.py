@@ -0,0 +1,37 @@
+from utils.cost import scan_bytecode, estimate_cost, tier_for_cost, estimated_wait, backlog_key, cost_tiers, priority_steps
+from unittest.mock import Mock
+
+
+def test_scan_bytecode_skips_push_data():
+    # PUSH2 0x5656, JUMPI, PUSH1 0x57, JUMP, STOP
+    assert scan_bytecode("0x6156565760575600") == (8, 2)
+    assert scan_bytecode(None) == (0, 0)
+
+
+def test_estimate_grows_with_limits():
+    code = "0x" + "6000566000575b" * 200
+    default = estimate_cost(code, {})
+    deep = estimate_cost(code, {"max_depth": 1024, "transaction_count": 5})
+
+    assert deep > default
+    # the symbolic part never exceeds the mythril timeouts
+    assert estimate_cost(code, {"max_depth": 100000, "execution_timeout": 10, "create_timeout": 10}) <= 5 + 1 + 20
+
+
+def test_estimate_without_code():
+    assert estimate_cost(None, {"execution_timeout": 600, "create_timeout": 40}) == 645
+
+
+def test_tier_for_cost():
+    assert tier_for_cost(1) == (cost_tiers[0][0], 0)
+    assert tier_for_cost(cost_tiers[0][1])[0] == cost_tiers[0][0]
+    assert tier_for_cost(cost_tiers[0][1] + 1) == (cost_tiers[1][0], 0)
+    assert tier_for_cost(100000) == (cost_tiers[-1][0], priority_steps[-1])
+
+
+def test_estimated_wait():
+    redis = Mock()
+    redis.get_members.return_value = ["a:100", "b:20"]
+
+    assert estimated_wait(redis, "analysis_small", 10) == 40
+    redis.get_members.assert_called_once_with(backlog_key("analysis_small"))
@@ -1,6 +1,8 @@
-from utils.disassembly import addTypeToBlock, generate_jumps
+from utils.disassembly import addTypeToBlock, generate_jumps, bytecode_hash, analysis_key, parts_key, create_render_data, block_documents, collect_subgraph
 from datatypes.data import ReportedBasicBlocks, ReportedInstructions, ReportedSymbolicExecSummary, Log, ReportedSymbolicVariable, StorageLoad, TypedAnnotation
+from datatypes.json_mapping import compact_instructions, expand_instructions, json_to_basic_block, to_document
 from unittest.mock import Mock, PropertyMock
+import pyevmasm as EVMAsm
 from hexbytes import HexBytes
 
 
@@ -45,3 +47,165 @@ def test_valid_false_jump_target():
 
     assert generate_jumps(bb, pc_to_block, conditional=True) == [
         {"source": 2, "target": 4, "condition": False}]
+
+
+def test_bytecode_hash():
+    empty_hash = "0xc5d2460186f7233c927e7db2dcc703c0e500b653ca82273b7bfad8045d85a470"
+
+    assert bytecode_hash("0x") == empty_hash
+    assert bytecode_hash("0x6080604052") == bytecode_hash("6080604052")
+    assert bytecode_hash("0x6080604052") != bytecode_hash("0x6080604053")
+
+
+def stored_instruction(pc, opcode, name, operand_size=0, operand=None):
+    return {"instruction": {"_opcode": opcode, "_name": name, "_operand_size": operand_size, "_pops": "0", "_pushes": "0",
+                            "_fee": "3", "_description": name, "_operand": operand, "_pc": pc}, "annotations": []}
+
+
+def stored_analysis():
+    symbolic_keys = ["functions", "calls", "storage_reads", "storage_writes", "memory_reads", "memory_writes", "returns", "reverts", "calldataloads",
+                     "calldatacopies", "selfdestructs", "conditional_jumps", "unconditional_jumps", "pushes", "creates", "create2s", "sender_constraint_functions"]
+    symbolic_summary = {key: [] for key in symbolic_keys}
+    symbolic_summary['logs'] = [{"tags": {}, "pc": "3", "n": "0", "topic0": None,
+                                 "topic1": None, "topic2": None, "topic3": None, "data": None}]
+    symbolic_summary['unique_instructions_visited'] = "1"
+
+    return {
+        "disassembly_summary": {"constants": [], "function_entrypoints": [], "jump_targets": [], "jumps": [], "jumpdests": [],
+                                "meta_data": {"raw": None, "index": None, "data": None, "url": None},
+                                "unique_instructions_visited": "2", "total_instructions": "4"},
+        "symbolic_summary": symbolic_summary,
+        "bbs": [
+            {"i": "0", "instructions": [stored_instruction("0", "96", "PUSH1", "1", "128"), stored_instruction(
+                "2", "91", "JUMPDEST")], "annotations": [], "nextBlockIndex": "1"},
+            {"i": "1", "instructions": [stored_instruction(
+                "3", "160", "LOG0")], "annotations": []},
+        ],
+        "pc_to_block": {"0": "0", "2": "0", "3": "1"},
+    }
+
+
+def test_render_data():
+    render_data = create_render_data(stored_analysis())
+    blocks = render_data['blocks']
+
+    assert render_data['coverage'] == {"assembly": 0.5, "symbolic": 0.25}
+    assert [block['i'] for block in blocks] == [0, 1]
+    assert blocks[0]['next'] == "1"
+    assert blocks[0]['types'] == []
+    assert blocks[1]['types'] == ["logs"]
+    assert blocks[0]['instructions'][0]['instruction']['_operand'] == "128"
+    assert blocks[1]['instructions'][0]['instruction']['_name'] == "LOG0"
+
+
+def test_render_data_static_stage():
+    render_data = create_render_data(
+        {**stored_analysis(), "symbolic_summary": None})
+    blocks = render_data['blocks']
+
+    assert render_data['coverage'] == {"assembly": 0.5, "symbolic": None}
+    assert blocks[1]['types'] == []
+    assert "function" not in blocks[0]
+
+
+def chain_documents(length):
+    # blocks 0 -> 1 -> ... -> length - 1 with links stored as strings like in mongodb
+    blocks = [{"i": i} for i in range(length)]
+    links = [{"source": str(i), "target": str(i + 1)}
+             for i in range(length - 1)]
+    documents = block_documents("0x1", blocks, links)
+
+    return {document['i']: document for document in documents}
+
+
+def test_block_documents():
+    documents = chain_documents(3)
+
+    assert documents[0]['links'] == [{"source": "0", "target": "1"}]
+    assert documents[0]['predecessors'] == []
+    assert documents[2]['links'] == []
+    assert documents[2]['predecessors'] == [1]
+
+
+def test_neighborhood_subgraph():
+    documents = chain_documents(6)
+
+    def find_blocks(ids): return [documents[i] for i in ids]
+
+    subgraph = collect_subgraph(2, find_blocks, 1, 100)
+
+    assert [block['i'] for block in subgraph['blocks']] == [1, 2, 3]
+    assert subgraph['links'] == [{"source": "1", "target": "2"}, {
+        "source": "2", "target": "3"}]
+
+
+def test_forward_subgraph_limit():
+    documents = chain_documents(6)
+
+    def find_blocks(ids): return [documents[i] for i in ids]
+
+    assert [block['i'] for block in collect_subgraph(
+        2, find_blocks, None, 100, backwards=False)['blocks']] == [2, 3, 4, 5]
+    assert [block['i'] for block in collect_subgraph(
+        2, find_blocks, None, 2, backwards=False)['blocks']] == [2, 3]
+
+
+def disassembled_instructions(code):
+    # instructions as stored in mongodb, all numbers are strings
+    return [{"instruction": {k: str(v) if isinstance(v, int) else v for k, v in instruction.__dict__.items()}, "annotations": []}
+            for instruction in EVMAsm.disassemble_all(bytes.fromhex(code))]
+
+
+def test_compact_instructions_roundtrip():
+    # push, push, mstore, unknown opcode, designated invalid
+    instructions = disassembled_instructions("60806040520cfe")
+    instructions[2]['annotations'] = [{"_class": "MemoryWrite", "data": {}}]
+
+    columns = compact_instructions(instructions)
+
+    assert columns['pcs'] == [0, 2, 4, 5, 6]
+    assert columns['operands'] == ["128", "64", None, None, None]
+    assert list(columns['annotations'].keys()) == ["2"]
+    assert expand_instructions(columns) == instructions
+
+
+def test_compact_basic_block():
+    instructions = disassembled_instructions("6080604052")
+    block = json_to_basic_block({"i": "0", "instructions": compact_instructions(
+        instructions), "annotations": []})
+
+    assert [instruction.pc() for instruction in block.instructions] == ["0", "2", "4"]
+    assert block.instructions[0].instruction._name == "PUSH"
+
+
+def test_document_integers():
+    document = to_document({"zero": 0, "safe": 2 ** 53 - 1, "unsafe": 2 ** 53 + 1, "negative": -2 ** 64, "keys": {16: 1, None: 2},
+                            "items": (1, [2 ** 256 - 1]), "flag": True})
+
+    # every integer is a string like the previous IntDecoder returned, javascript would round values above 2^53
+    assert document == {"zero": "0", "safe": str(2 ** 53 - 1), "unsafe": "9007199254740993", "negative": str(-2 ** 64), "keys": {"16": "1", "null": "2"},
+                        "items": ["1", [str(2 ** 256 - 1)]], "flag": True}
+
+
+def test_document_objects():
+    annotation = StorageLoad(tags={"tag": True}, pc=4,
+                             slot=ReportedSymbolicVariable(2 ** 160))
+
+    assert to_document(TypedAnnotation(_class="StorageLoad", data=annotation)) == {
+        "_class": "StorageLoad", "data": {"tags": {"tag": True}, "pc": "4", "slot": {"var": str(2 ** 160), "symbolic": False}}}
+
+
+def test_analysis_key():
+    code_hash = bytecode_hash("0x6080604052")
+
+    assert analysis_key(code_hash, {"a": 1, "b": 2}) == analysis_key(
+        code_hash, {"b": 2, "a": 1})
+    assert analysis_key(code_hash, {"a": 1}) != analysis_key(code_hash, {"a": 2})
+    assert analysis_key(code_hash, {"a": 1}).startswith(code_hash + "-")
+
+
+def test_parts_key_is_new_generation():
+    key = analysis_key(bytecode_hash("0x6080604052"), {"a": 1})
+
+    assert parts_key(key).startswith(key + "-")
+    assert parts_key(key) != parts_key(key)
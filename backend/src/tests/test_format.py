@@ -0,0 +1,20 @@
+from utils.format import queued_tasks
+
+
+def test_queued_tasks_only_lists_analyses():
+    mythril_args = {"max_depth": 128}
+    task_dict = {"worker@light": [
+        {"type": "refresh_information", "id": "1", "time_start": 1673175191,
+         "args": ["0xab", "basic", "etherscan-token", "https://rpc.example"]},
+        {"type": "refresh_source", "id": "2", "time_start": 1673175191,
+         "args": ["0xab", "etherscan-token", "https://rpc.example"]},
+        {"type": "get_disassembly", "id": "3", "time_start": 1673175191,
+         "args": ["0xab", {"etherscan_token": "etherscan-token"}, mythril_args]},
+    ]}
+
+    tasks = queued_tasks(task_dict, "active", [
+                         "get_disassembly", "get_symbolic_disassembly"])
+
+    assert [task['id'] for task in tasks] == ["3"]
+    assert tasks[0]['args'] == mythril_args
+    assert "etherscan-token" not in str(tasks)
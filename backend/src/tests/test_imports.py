@@ -0,0 +1,11 @@
+import subprocess
+import sys
+
+
+def test_web_modules_without_mythril():
+    # a fresh interpreter because other tests load the analysis modules
+    script = "import sys, utils, utils.information, utils.disassembly, utils.signatures, utils.source, datatypes.instructions; print('mythril' in sys.modules, 'z3' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", script],
+                            capture_output=True, text=True, check=True)
+
+    assert result.stdout.split() == ["False", "False"]
@@ -1,6 +1,10 @@
 from unittest.mock import Mock, MagicMock, patch
-from utils.information import etherscan_contract_creation, etherscan_transactions, retrieve_events
+from utils.information import etherscan_contract_creation, transaction_history, transactions_before, internal_transactions_before, parse_cursor, next_cursor, next_internal_cursor, retrieve_events, fetch_log_chunk, block_timestamps, decode_events, submit_upstream, upstream_result, UpstreamTimeout
+from hexbytes import HexBytes
+from utils.redis import ImmutableCache
 import pytest
+from concurrent.futures import ThreadPoolExecutor
+import time
 
 
 @patch('utils.information.requests')
@@ -49,27 +53,58 @@ def test_basic_information_valid(request_mock):
     address = "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48"
 
     assert etherscan_contract_creation("",
-                                       address, eth) == (eth.get_proxy_transaction_by_hash(), creator, timestamp)
+                                       address, eth) == (eth.get_proxy_transaction_by_hash(), creator, int(timestamp))
 
 
-def test_empty_transaction_retrieval():
+class HistoryStore(object):
+    def __init__(self, history=None):
+        self.history = history
+
+    def find_history(self, address):
+        return self.history
+
+    def save_history(self, address, watermark, normal, internal):
+        self.history = {"watermark": watermark,
+                        "normal": normal, "internal": internal}
+
+
+def test_initial_transaction_history():
     address = "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48"
+    normal = [{"hash": "0x2", "blockNumber": "16361550"},
+              {"hash": "0x1", "blockNumber": "16361000"}]
     eth = Mock()
-    eth.get_normal_txs_by_address = Mock(return_value=[])
-    eth.get_internal_txs_by_address = Mock(return_value=[])
+    eth.get_normal_txs_by_address_paginated = Mock(return_value=normal)
+    eth.get_internal_txs_by_address_paginated = Mock(
+        side_effect=AssertionError("No transactions found"))
     eth.get_proxy_block_number = Mock(return_value="16361554")
-    assert etherscan_transactions(address, eth, 100000) == ([], [])
+    store = HistoryStore()
 
+    assert transaction_history(address, eth, 100000, store) == (normal, [])
+    assert store.history['watermark'] == 16361554
+    eth.get_normal_txs_by_address_paginated.assert_called_once_with(
+        address=address.lower(), page=1, offset=200, startblock=16261554, endblock=16361554, sort="desc")
 
-def test_random_transaction_data_retrieval():
+
+def test_incremental_transaction_history():
     address = "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48"
-    normal = ["sent 1 eth", "sent 2 eth"]
-    internal = ["sent internal 0.3 eth", "sent internal 3.2 eth"]
+    # the transaction near the old head was reorged out
+    store = HistoryStore({"watermark": 16361554, "normal": [{"hash": "0x3", "blockNumber": "16361554"}, {
+                         "hash": "0x2", "blockNumber": "16361000"}], "internal": [{"hash": "0x2", "blockNumber": "16361000"}]})
+    new = [{"hash": "0x5", "blockNumber": "16361600"},
+           {"hash": "0x4", "blockNumber": "16361550"}]
     eth = Mock()
-    eth.get_normal_txs_by_address = Mock(return_value=normal)
-    eth.get_internal_txs_by_address = Mock(return_value=internal)
-    eth.get_proxy_block_number = Mock(return_value="16361554")
-    assert etherscan_transactions(address, eth, 100000) == (normal, internal)
+    eth.get_normal_txs_by_address_paginated = Mock(return_value=new)
+    eth.get_internal_txs_by_address_paginated = Mock(return_value=[])
+    eth.get_proxy_block_number = Mock(return_value="16361610")
+
+    normal, internal = transaction_history(address, eth, 100000, store)
+
+    assert [tx['hash'] for tx in normal] == ["0x5", "0x4", "0x2"]
+    assert [tx['hash'] for tx in internal] == ["0x2"]
+    assert store.history['watermark'] == 16361610
+    assert eth.get_normal_txs_by_address_paginated.call_args.kwargs[
+        'startblock'] == 16361554 - 11
+
 
 def test_empty_event_retrieval():
     mock_response = Mock(return_value=[])
@@ -80,17 +115,261 @@ def test_empty_event_retrieval():
     eth.get_proxy_block_number = Mock(return_value="16361554")
     assert retrieve_events(web3_mock, address, eth, 100000, 10000) == []
 
+def chain_logs(blocks):
+    # get_logs of a fake chain with one log in each of the given blocks, ascending like a node returns them
+    def get_logs(log_filter):
+        return [{"blockNumber": block} for block in sorted(blocks) if log_filter['fromBlock'] <= block <= log_filter['toBlock']]
+    return get_logs
+
+
 def test_random_event_data_retrieval():
     test_events = ["loggin some transfer",
                    "logging another transfer", "another one"]
-    reverse_events = test_events
-    reverse_events.reverse()
-    mock_response = Mock(return_value=test_events)
+    reverse_events = list(reversed(test_events))
+
+    def get_logs(log_filter):
+        # all events are in the most recent chunk
+        return list(test_events) if log_filter['toBlock'] == 16361554 else []
     address = "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48"
     eth = Mock()
     web3_mock = Mock()
-    web3_mock.eth.get_logs = mock_response
+    web3_mock.eth.get_logs = Mock(side_effect=get_logs)
     eth.get_proxy_block_number = Mock(return_value="16361554")
 
     assert retrieve_events(web3_mock, address, eth,
                            100000, 10000) == reverse_events
+
+
+def test_event_retrieval_newest_first():
+    blocks = [16361554 - 7 * i for i in range(200)]
+    address = "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48"
+    eth = Mock()
+    web3_mock = Mock()
+    web3_mock.eth.get_logs = Mock(side_effect=chain_logs(blocks))
+    eth.get_proxy_block_number = Mock(return_value="16361554")
+
+    logs = retrieve_events(web3_mock, address, eth, 100000, 100)
+
+    assert [log['blockNumber'] for log in logs] == blocks[:50]
+    # stops once enough logs are collected instead of scanning all blocks
+    assert min(call.args[0]['fromBlock'] for call in web3_mock.eth.get_logs.call_args_list) > 16361554 - 100000
+
+
+def test_event_retrieval_provider_limit():
+    blocks = list(range(16361000, 16361555))
+    address = "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48"
+    eth = Mock()
+    web3_mock = Mock()
+    get_logs = chain_logs(blocks)
+
+    def capped_get_logs(log_filter):
+        logs = get_logs(log_filter)
+        if len(logs) > 20:
+            raise ValueError({"code": -32005, "message": "query returned more than 20 results"})
+        return logs
+    web3_mock.eth.get_logs = Mock(side_effect=capped_get_logs)
+    eth.get_proxy_block_number = Mock(return_value="16361554")
+
+    logs = retrieve_events(web3_mock, address, eth, 100000, 10000)
+
+    assert [log['blockNumber'] for log in logs] == list(reversed(blocks))[:50]
+
+
+def test_log_chunk_skips_older_half():
+    blocks = list(range(1000, 1100))
+    web3_mock = Mock()
+    get_logs = chain_logs(blocks)
+
+    def capped_get_logs(log_filter):
+        logs = get_logs(log_filter)
+        if len(logs) > 60:
+            raise ValueError({"code": -32005, "message": "query returned more than 60 results"})
+        return logs
+    web3_mock.eth.get_logs = Mock(side_effect=capped_get_logs)
+
+    logs, split = fetch_log_chunk(web3_mock, "0x0", 1000, 1099, limit=50)
+
+    assert split
+    assert [log['blockNumber'] for log in logs] == list(reversed(blocks))[:50]
+    # the refused range and its newer half, the older half already has enough logs
+    assert [call.args[0]['fromBlock'] for call in web3_mock.eth.get_logs.call_args_list] == [1000, 1050]
+
+def batch_response(blocks):
+    # answers eth_getBlockByNumber batch requests with the timestamp of each requested block
+    def post(url, json, timeout):
+        response = MagicMock()
+        response.json.return_value = [{"jsonrpc": "2.0", "id": call['id'], "result": {
+            "timestamp": hex(blocks[int(call['params'][0], 16)])}} for call in json]
+        return response
+    return post
+
+
+@patch('utils.information.requests')
+def test_batched_block_timestamps(request_mock):
+    request_mock.post.side_effect = batch_response({100: 1673175191, 101: 1673175203})
+    web3_mock = Mock()
+
+    assert block_timestamps(web3_mock, [101, 100, 101, 100]) == {
+        100: 1673175191, 101: 1673175203}
+    assert request_mock.post.call_count == 1
+    assert len(request_mock.post.call_args.kwargs['json']) == 2
+    web3_mock.eth.getBlock.assert_not_called()
+
+
+@patch('utils.information.requests')
+def test_unsupported_batch_timestamps(request_mock):
+    request_mock.post.return_value.json.return_value = {
+        "jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": "batch not supported"}}
+    web3_mock = Mock()
+    web3_mock.eth.getBlock = Mock(return_value=Mock(timestamp=1673175191))
+
+    assert block_timestamps(web3_mock, [100, 100]) == {100: 1673175191}
+    web3_mock.eth.getBlock.assert_called_once_with(100)
+
+
+@patch('utils.information.signature_cache')
+@patch('utils.information.requests')
+def test_decode_events_without_abi(request_mock, signature_mock):
+    request_mock.post.side_effect = batch_response({100: 1673175191})
+    signature_mock.event_name = Mock(return_value=["Paused()"])
+    logs = [{"topics": [HexBytes("0x62e78cea01bee320cd4e420270b5ea74000d11b0c9f74754ebdbfc544b05a258")], "data": "0x",
+             "blockNumber": 100, "transactionHash": HexBytes("0x581a39e160575f3beed955f7185dd9302e56e1822b8f8946c81c9f29d9ff3430")}]
+    web3_mock = Mock()
+
+    events = decode_events(web3_mock, "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48", logs)
+
+    assert len(events) == 1
+    assert events[0]['signature'] == "Paused()"
+    assert events[0]['transactionHash'] == "0x581a39e160575f3beed955f7185dd9302e56e1822b8f8946c81c9f29d9ff3430"
+    assert events[0]['timestamp'] != "-"
+    web3_mock.eth.getTransaction.assert_not_called()
+
+
+@patch('utils.information.requests')
+def test_contract_creation_cached(request_mock):
+    eth = Mock()
+    hash = "0x581a39e160575f3beed955f7185dd9302e56e1822b8f8946c81c9f29d9ff3430"
+    creator = "0xaf64d797f9c2364ad614476188d5ac9443812f99"
+    mock_response = MagicMock()
+    mock_response.json.return_value = {"message": "OK", "result": [
+        {'txHash': hash, 'contractCreator': creator}]}
+    request_mock.get.return_value = mock_response
+    transaction = {"hash": hash, "blockNumber": "0xf9a8d2"}
+    eth.get_proxy_transaction_by_hash = Mock(return_value=transaction)
+    eth.get_proxy_block_by_number = Mock(
+        return_value={"timestamp": "0x63bad397"})
+    address = "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48"
+    cache = ImmutableCache()
+
+    first = etherscan_contract_creation("", address, eth, cache)
+    second = etherscan_contract_creation("", address, eth, cache)
+
+    expected = ({**transaction, "blockNumber": 0xf9a8d2}, creator, 0x63bad397)
+    assert first == expected
+    assert second == expected
+    eth.get_proxy_block_by_number.assert_called_once_with(tag="0xf9a8d2")
+    assert eth.get_proxy_transaction_by_hash.call_count == 1
+    assert eth.get_proxy_block_by_number.call_count == 1
+
+
+@patch('utils.information.requests')
+def test_block_timestamps_cached(request_mock):
+    web3_mock = Mock()
+    web3_mock.provider.endpoint_uri = "http://node"
+    cache = ImmutableCache(size=2)
+    cache.set_many("block-timestamp", {10: 1000})
+    request_mock.post.side_effect = batch_response({11: 1100, 12: 1200})
+
+    assert block_timestamps(web3_mock, [10, 11, 12], cache) == {
+        10: 1000, 11: 1100, 12: 1200}
+    requested = [call["params"][0]
+                 for call in request_mock.post.call_args.kwargs['json']]
+    assert requested == [hex(11), hex(12)]
+    # only the most recently used entries are kept in process
+    assert list(cache.local) == ["immutable-block-timestamp-11",
+                                 "immutable-block-timestamp-12"]
+
+
+def test_upstream_calls_concurrent():
+    def slow(value):
+        time.sleep(0.2)
+        return value
+
+    start = time.monotonic()
+    calls = submit_upstream({"first": lambda: slow(1), "second": lambda: slow(2)})
+
+    assert upstream_result(calls['first']) == 1
+    assert upstream_result(calls['second']) == 2
+    assert time.monotonic() - start < 0.35
+
+
+def test_upstream_call_timeout():
+    calls = submit_upstream({"slow": lambda: time.sleep(0.2)})
+
+    with pytest.raises(UpstreamTimeout):
+        upstream_result(calls['slow'], 0.01)
+
+
+def test_upstream_timeout_starts_with_call():
+    # a single worker that is busy longer than the timeout of the queued call
+    with patch('utils.information.upstream_executor', ThreadPoolExecutor(max_workers=1)):
+        calls = submit_upstream(
+            {"busy": lambda: time.sleep(0.2), "quick": lambda: 1})
+
+        assert upstream_result(calls['quick'], 0.1) == 1
+
+
+def test_cursor_parsing():
+    assert parse_cursor("16361554-3") == (16361554, 3)
+    with pytest.raises(ValueError):
+        parse_cursor("16361554")
+    with pytest.raises(ValueError):
+        parse_cursor("latest-3")
+
+
+def test_transaction_page_after_cursor():
+    address = "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48"
+    txs = [{"hash": f"0x{block}{index}", "blockNumber": str(block), "transactionIndex": str(index)}
+           for block in range(16361554, 16361454, -1) for index in [5, 2]]
+    eth = Mock()
+    eth.get_normal_txs_by_address_paginated = Mock(return_value=txs[1:101])
+
+    page = transactions_before(address, eth, (16361554, 5), 100000)
+
+    assert page == txs[1:51]
+    assert next_cursor(page, 'transactionIndex') == "16361529-5"
+    assert eth.get_normal_txs_by_address_paginated.call_args.kwargs['endblock'] == 16361554
+
+
+def test_internal_transaction_page_after_cursor():
+    address = "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48"
+    # three internal transactions per block, two of block 16361554 were shown already
+    txs = [{"hash": f"0x{block}", "blockNumber": str(block), "traceId": str(trace)}
+           for block in range(16361554, 16361504, -1) for trace in range(3)]
+    eth = Mock()
+    eth.get_internal_txs_by_address_paginated = Mock(return_value=txs[:52])
+
+    page = internal_transactions_before(address, eth, (16361554, 2), 100000)
+
+    assert page == txs[2:52]
+    assert next_internal_cursor(page, (16361554, 2)) == "16361537-1"
+    assert next_internal_cursor(page[:10]) == None
+
+
+def test_event_page_after_cursor():
+    blocks = [16361554 - i for i in range(200)]
+    address = "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48"
+    eth = Mock()
+    web3_mock = Mock()
+
+    def get_logs(log_filter):
+        return [{"blockNumber": block, "logIndex": index} for block in sorted(blocks) for index in [0, 1] if log_filter['fromBlock'] <= block <= log_filter['toBlock']]
+    web3_mock.eth.get_logs = Mock(side_effect=get_logs)
+
+    logs = retrieve_events(web3_mock, address, eth,
+                           100000, 100, before=(16361500, 1))
+
+    assert logs[0] == {"blockNumber": 16361500, "logIndex": 0}
+    assert logs[1] == {"blockNumber": 16361499, "logIndex": 1}
+    assert next_cursor(logs, 'logIndex') == "16361475-1"
+    eth.get_proxy_block_number.assert_not_called()
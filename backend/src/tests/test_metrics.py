@@ -0,0 +1,73 @@
+from utils.metrics import Metrics, render, collect, sample, metrics_key, peaks_key
+from unittest.mock import Mock
+import pytest
+
+
+def test_observe_cumulative_buckets():
+    metrics = Metrics()
+    metrics.observe("task_seconds", 0.3, task="get_disassembly")
+    metrics.observe("task_seconds", 70, task="get_disassembly")
+
+    pending = metrics.pending
+    assert pending[sample("task_seconds_bucket", {
+                          "task": "get_disassembly", "le": 0.1})] == 0
+    assert pending[sample("task_seconds_bucket", {
+                          "task": "get_disassembly", "le": 0.5})] == 1
+    assert pending[sample("task_seconds_bucket", {
+                          "task": "get_disassembly", "le": 120})] == 2
+    assert pending[sample("task_seconds_bucket", {
+                          "task": "get_disassembly", "le": "+Inf"})] == 2
+    assert pending[sample("task_seconds_count", {
+                          "task": "get_disassembly"})] == 2
+    assert pending[sample("task_seconds_sum", {
+                          "task": "get_disassembly"})] == pytest.approx(70.3)
+
+
+def test_render_orders_buckets():
+    metrics = Metrics()
+    metrics.observe("upstream_seconds", 3, call="balance")
+    metrics.increment("cache_requests_total", cache="route", result="hit")
+
+    lines = render(metrics.pending).splitlines()
+    assert "# TYPE ctrleth_upstream_seconds histogram" in lines
+    assert 'ctrleth_cache_requests_total{cache="route",result="hit"} 1' in lines
+
+    series = [line for line in lines if line.startswith(
+        "ctrleth_upstream_seconds")]
+    assert series[0] == 'ctrleth_upstream_seconds_bucket{call="balance",le="0.005"} 0'
+    assert series[-3] == 'ctrleth_upstream_seconds_bucket{call="balance",le="+Inf"} 1'
+    assert series[-2] == 'ctrleth_upstream_seconds_sum{call="balance"} 3'
+    assert series[-1] == 'ctrleth_upstream_seconds_count{call="balance"} 1'
+
+
+def test_upstream_call_counts_errors():
+    metrics = Metrics()
+
+    def failing():
+        raise ValueError("rate limited")
+
+    with pytest.raises(ValueError):
+        metrics.upstream_call(failing, call="balance")()
+
+    assert metrics.pending[sample(
+        "upstream_errors_total", {"call": "balance"})] == 1
+    assert metrics.pending[sample(
+        "upstream_seconds_count", {"call": "balance"})] == 1
+
+
+def test_flush_and_collect():
+    redis = Mock()
+    metrics = Metrics(redis)
+    metrics.increment("cache_requests_total", 2,
+                      cache="signature", result="miss")
+    metrics.flush()
+
+    redis.increment_many.assert_called_once_with(
+        metrics_key, {sample("cache_requests_total", {"cache": "signature", "result": "miss"}): 2})
+    assert len(metrics.pending) == 0
+
+    redis.get_values.side_effect = lambda key: {
+        metrics_key: {"a": 1.0}, peaks_key: {"b": 2.0}}[key]
+    redis.get_counters.return_value = {"computed": 3}
+    assert collect(redis, "single-flight-stats") == {"a": 1.0, "b": 2.0, sample(
+        "single_flight_total", {"outcome": "computed"}): 3}
@@ -0,0 +1,77 @@
+from utils.progress import publish_progress, progress_events, progress_channel, format_event
+import json
+
+
+class FakeSubscription(object):
+    # returns the published messages one by one and None once they are read
+    def __init__(self, messages):
+        self.messages = messages
+        self.closed = False
+
+    def get_message(self, timeout=0):
+        if len(self.messages) == 0:
+            return None
+        return {"type": "message", "data": self.messages.pop(0)}
+
+    def close(self):
+        self.closed = True
+
+
+class FakeRedis(object):
+    def __init__(self):
+        self.values = {}
+        self.messages = []
+        self.subscription = None
+
+    def publish(self, channel, message, ttl):
+        self.values[channel] = message
+        self.messages.append(message)
+
+    def get_routes_from_cache(self, key):
+        return self.values.get(key)
+
+    def subscribe(self, channel):
+        self.subscription = FakeSubscription(self.messages)
+        return self.subscription
+
+
+def test_publish_keeps_latest_event():
+    redis = FakeRedis()
+    publish_progress(redis, "0xAB", "queued", queue="analysis_small")
+    latest = publish_progress(redis, "0xab", "static")
+
+    assert json.loads(redis.values[progress_channel("0xAB")]) == latest
+    assert latest['address'] == "0xab"
+
+
+def test_events_start_with_latest_and_end_when_finished():
+    redis = FakeRedis()
+    queued = publish_progress(redis, "0xab", "queued")
+    redis.messages.clear()
+    publish_progress(redis, "0xab", "static")
+    publish_progress(redis, "0xab", "finished")
+    redis.values[progress_channel("0xab")] = json.dumps(queued)
+
+    events = [event['event']
+              for event in progress_events(redis, "0xab", timeout=1)]
+
+    assert events == ["queued", "static", "finished"]
+    assert redis.subscription.closed
+
+
+def test_events_skip_received_latest():
+    redis = FakeRedis()
+    finished = publish_progress(redis, "0xab", "finished")
+    redis.messages.clear()
+
+    events = list(progress_events(redis, "0xab", finished['id'], timeout=0.01))
+
+    # only heartbeats until the timeout
+    assert all(event == None for event in events)
+
+
+def test_format_event():
+    event = {"id": "1", "event": "static"}
+    assert format_event(
+        event) == f"id: 1\nevent: static\ndata: {json.dumps(event)}\n\n"
+    assert format_event(None).startswith(":")
@@ -0,0 +1,161 @@
+from utils.redis import single_flight, cached_value, refresh_entry, previous_key, flight_stats_key
+from unittest.mock import Mock
+from utils.codec import ZlibCodec, decode
+from unittest.mock import patch
+import threading
+import json
+import time
+
+
+class FakeRedis(object):
+    # keeps values and locks in dicts, ttls are ignored
+    def __init__(self):
+        self.values = {}
+        self.fresh = set()
+        self.refreshing = set()
+        self.locks = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def get_routes_from_cache(self, key):
+        return self.values.get(key)
+
+    def set_routes_to_cache(self, key, value, ttl=0):
+        self.values[key] = value
+        return True
+
+    def load_from_cache(self, key):
+        return decode(self.values.get(key))
+
+    def set_fresh_to_cache(self, key, value):
+        self.values[key] = ZlibCodec().encode(value)
+        self.fresh.add(key)
+        return True
+
+    def is_fresh(self, key):
+        return key in self.fresh
+
+    def claim_refresh(self, key, timeout):
+        with self.lock:
+            if key in self.refreshing:
+                return False
+            self.refreshing.add(key)
+            return True
+
+    def acquire_lock(self, key, timeout):
+        with self.lock:
+            if key in self.locks:
+                return None
+            self.locks[key] = "token"
+            return "token"
+
+    def release_lock(self, key, token):
+        with self.lock:
+            self.locks.pop(key, None)
+
+    def is_locked(self, key):
+        return key in self.locks
+
+    def increment(self, key, field, amount=1):
+        with self.lock:
+            self.counters[field] = self.counters.get(field, 0) + amount
+
+
+def test_single_flight_cached():
+    redis = FakeRedis()
+    redis.set_fresh_to_cache("key", {"value": 1})
+
+    assert single_flight(redis, "key", lambda: 1 / 0) == {"value": 1}
+
+
+def test_single_flight_coalesced():
+    redis = FakeRedis()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.3)
+        redis.set_fresh_to_cache("key", {"value": 1})
+        return {"value": 1}
+
+    results = []
+    with patch('utils.redis.flight_poll', 0.01):
+        threads = [threading.Thread(target=lambda: results.append(
+            single_flight(redis, "key", compute))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert results == [{"value": 1}] * 5
+    assert len(calls) == 1
+    assert redis.counters == {"computed": 1, "coalesced": 4}
+    assert decode(redis.values[previous_key("key")]) == {"value": 1}
+
+
+def test_single_flight_previous_value():
+    redis = FakeRedis()
+    redis.set_routes_to_cache(previous_key("key"), json.dumps({"value": 0}))
+    redis.acquire_lock("key", 10)
+
+    assert single_flight(redis, "key", lambda: 1 / 0) == {"value": 0}
+    assert redis.counters == {"served_previous": 1}
+
+
+def test_single_flight_failed_computation():
+    redis = FakeRedis()
+    redis.acquire_lock("key", 10)
+    # the computing request stops without a value
+    threading.Timer(0.05, lambda: redis.release_lock("key", "token")).start()
+
+    with patch('utils.redis.flight_poll', 0.01):
+        assert single_flight(redis, "key", lambda: ("error", 500)) == (
+            "error", 500)
+    assert redis.counters == {"computed_after_wait": 1}
+
+
+def test_single_flight_busy():
+    redis = FakeRedis()
+    redis.acquire_lock("key", 10)
+
+    with patch('utils.redis.flight_wait', 0.05), patch('utils.redis.flight_poll', 0.01):
+        body, status, headers = single_flight(redis, "key", lambda: 1 / 0)
+    # the slow computation still holds the lock, the request is not computed a second time
+    assert status == 503
+    assert headers["Retry-After"] == "5"
+    assert redis.counters == {"busy": 1}
+
+
+def test_stale_value_refreshed_once():
+    redis = FakeRedis()
+    redis.set_routes_to_cache("key", json.dumps({"value": 0}))
+    refresh = Mock()
+
+    assert single_flight(redis, "key", lambda: 1 / 0, refresh) == {"value": 0}
+    assert cached_value(redis, "key", refresh) == {"value": 0}
+    refresh.assert_called_once()
+    assert redis.counters == {"refreshed": 1}
+
+
+def test_fresh_value_not_refreshed():
+    redis = FakeRedis()
+    redis.set_fresh_to_cache("key", {"value": 1})
+    refresh = Mock()
+
+    assert cached_value(redis, "key", refresh) == {"value": 1}
+    refresh.assert_not_called()
+
+
+def test_refresh_entry():
+    redis = FakeRedis()
+
+    def compute():
+        redis.set_fresh_to_cache("key", {"value": 2})
+
+    assert refresh_entry(redis, "key", compute)
+    assert redis.load_from_cache("key") == {"value": 2}
+    assert not redis.is_locked("key")
+
+    # skipped while a request computes the value
+    redis.acquire_lock("key", 10)
+    assert not refresh_entry(redis, "key", lambda: 1 / 0)
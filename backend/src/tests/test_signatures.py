@@ -0,0 +1,69 @@
+from unittest.mock import Mock
+from utils.signatures import SignatureCache, function_definition
+import sqlite3
+import json
+
+
+def test_signature_lookup_cached():
+    provider = Mock()
+    provider.function_name = Mock(return_value=["transfer(address,uint256)"])
+    redis = Mock()
+    redis.load_from_cache = Mock(return_value=None)
+    cache = SignatureCache(provider, redis)
+
+    assert cache.function_name("0xA9059CBB") == ["transfer(address,uint256)"]
+    assert cache.function_name("a9059cbb") == ["transfer(address,uint256)"]
+    provider.function_name.assert_called_once_with("0xA9059CBB")
+    redis.store_to_cache.assert_called_once_with(
+        "signature-function-0xa9059cbb", ["transfer(address,uint256)"], ttl=60 * 60 * 24 * 7)
+
+
+def test_signature_lookup_negative():
+    provider = Mock()
+    provider.event_name = Mock(return_value=None)
+    cache = SignatureCache(provider)
+    topic = "0x62e78cea01bee320cd4e420270b5ea74000d11b0c9f74754ebdbfc544b05a258"
+
+    assert cache.event_name(topic) == []
+    assert cache.event_name(topic) == []
+    provider.event_name.assert_called_once()
+
+
+def test_signature_lookup_from_redis():
+    provider = Mock()
+    redis = Mock()
+    redis.load_from_cache = Mock(return_value=["Paused()"])
+    cache = SignatureCache(provider, redis)
+    topic = "0x62e78cea01bee320cd4e420270b5ea74000d11b0c9f74754ebdbfc544b05a258"
+
+    assert cache.event_name(topic) == ["Paused()"]
+    provider.event_name.assert_not_called()
+
+
+def test_signature_prewarm(tmp_path):
+    database = tmp_path / "signatures.db"
+    connection = sqlite3.connect(database)
+    connection.execute(
+        "CREATE TABLE signatures (byte_sig VARCHAR(10), text_sig VARCHAR(255))")
+    connection.execute(
+        "INSERT INTO signatures VALUES ('0xa9059cbb', 'transfer(address,uint256)')")
+    connection.commit()
+    connection.close()
+    dump = tmp_path / "signatures.json"
+    dump.write_text(json.dumps(
+        {"events": {"0x62e78cea01bee320cd4e420270b5ea74000d11b0c9f74754ebdbfc544b05a258": ["Paused()"]}}))
+    provider = Mock()
+    cache = SignatureCache(provider, size=0)
+
+    assert cache.prewarm(str(database)) == 1
+    assert cache.prewarm(str(dump)) == 1
+    assert cache.function_name("0xa9059cbb") == ["transfer(address,uint256)"]
+    assert cache.event_name(
+        "0x62e78cea01bee320cd4e420270b5ea74000d11b0c9f74754ebdbfc544b05a258") == ["Paused()"]
+    provider.function_name.assert_not_called()
+    provider.event_name.assert_not_called()
+
+
+def test_function_definition_memoized():
+    assert function_definition(
+        "transfer(address,uint256)") is function_definition("transfer(address,uint256)")
@@ -3,11 +3,7 @@ from flask import Flask
 from flask_celeryext import FlaskCeleryExt
 from .celery import make_celery
 from dotenv import load_dotenv
-from ethpector.analysis import CodeAnalysis
-from ethpector.data import AggregateProvider
-from ethpector.config import Configuration
 from types import SimpleNamespace
-from datatypes.config import MythrilConfiguration
 
 load_dotenv()
 
@@ -28,7 +24,23 @@ def use_args(ethpector_rpc=None, etherscan_token=None):
             "tofile": None, "dont_drop_metadatastring": None, "offline": False, "nodotenv": None, "output": None, "output_dir": 'ethpector-output'}
 
 
-def get_analysis(address, args, mythril_args=None):
+def get_code(address, args):
+    # runtime bytecode of the address as hex string, "0x" for accounts without code
+    # ethpector is imported on first use, its analysis modules load mythril and z3 which the web tier rarely needs
+    from ethpector.data import AggregateProvider
+    from ethpector.config import Configuration
+
+    config = Configuration(SimpleNamespace(**args))
+    online_resolver = AggregateProvider(config)
+
+    return online_resolver.first_of(["node", "etherscan"]).get_code(address)
+
+
+def get_analysis(address, args, mythril_args=None, code=None):
+    from ethpector.analysis import CodeAnalysis
+    from ethpector.data import AggregateProvider
+    from ethpector.config import Configuration
+    from datatypes.config import MythrilConfiguration
 
     config = Configuration(SimpleNamespace(**args))
 
@@ -55,8 +67,6 @@ def get_analysis(address, args, mythril_args=None):
     if (account_summary.is_contract == None or not account_summary.is_contract):
         return {"task_error": {"message": "Address input is not a contract address", "status": 400, "type": 1}}
 
-    code = None
-
     try:
         code = (
             online_resolver.first_of(["node", "etherscan"]).get_code(address)
@@ -2,6 +2,7 @@ from celery import current_app as current_celery_app
 from kombu import Queue, Exchange
 import os
 from utils.redis import ttl
+from utils.cost import cost_tiers, priority_steps
 
 
 class CeleryOnceExcepton(Exception):
@@ -12,16 +13,25 @@ class CeleryOnceExcepton(Exception):
 
 def make_celery(app):
     # setting delivery mode to transient to avoid persisting messages which takes longer
+    # analyses are routed by their estimated cost to tiers with their own workers, so cheap analyses never wait behind deep ones
     task_queues = (
         Queue('celery', routing_key='celery'),
-        Queue('transient', Exchange('transient', delivery_mode=1),
-              routing_key='transient', durable=False),
+        *(Queue(queue, Exchange(queue, delivery_mode=1),
+                routing_key=queue, durable=False) for queue, _ in cost_tiers),
+        # short tasks like cache refreshes that should not wait behind analyses
+        Queue('light', Exchange('light', delivery_mode=1),
+              routing_key='light', durable=False),
     )
 
     celery = current_celery_app
     celery.config_from_object(app.config, namespace="CELERY")
     celery.conf.task_queues = task_queues
-    celery.conf.task_default_queue = 'transient'
+    celery.conf.task_default_queue = cost_tiers[1][0]
+    # messages of a queue are ordered by priority, within a tier cheaper analyses run first
+    celery.conf.broker_transport_options = {
+        'priority_steps': priority_steps,
+        'queue_order_strategy': 'priority',
+    }
     celery.conf.ONCE = {
         'backend': 'celery_once.backends.Redis',
         'settings': {
@@ -0,0 +1,86 @@
+from decimal import Decimal
+import threading
+import json
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    # entries are compressed with zlib without the optional package
+    zstandard = None
+
+# first byte of an encoded entry, entries written before the codecs were added are plain json
+zlib_version = 1
+zstd_version = 2
+compression_level = 3
+
+
+def json_default(o):
+    # decimals are stored as strings like the routes return them
+    if isinstance(o, Decimal):
+        return str(o)
+
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def dumps(value):
+    return json.dumps(value, default=json_default, separators=(",", ":")).encode("utf-8")
+
+
+class ZlibCodec(object):
+    """zlib compressed json."""
+
+    version = zlib_version
+
+    def encode(self, value):
+        return bytes([self.version]) + zlib.compress(dumps(value), compression_level)
+
+    def decode(self, payload):
+        return json.loads(zlib.decompress(payload))
+
+
+class ZstdCodec(object):
+    """zstd compressed json, smaller and faster than zlib for the repetitive route payloads."""
+
+    version = zstd_version
+
+    def __init__(self):
+        # zstd contexts must not be shared between threads
+        self.local = threading.local()
+
+    def contexts(self):
+        if not hasattr(self.local, "compressor"):
+            self.local.compressor = zstandard.ZstdCompressor(
+                level=compression_level)
+            self.local.decompressor = zstandard.ZstdDecompressor()
+        return self.local
+
+    def encode(self, value):
+        return bytes([self.version]) + self.contexts().compressor.compress(dumps(value))
+
+    def decode(self, payload):
+        return json.loads(self.contexts().decompressor.decompress(payload))
+
+
+def default_codec():
+    return ZstdCodec() if zstandard != None else ZlibCodec()
+
+
+codecs = {ZlibCodec.version: ZlibCodec()}
+if zstandard != None:
+    codecs[ZstdCodec.version] = ZstdCodec()
+
+
+def decode(raw):
+    """Value of an entry written by any codec or as plain json."""
+
+    if raw == None:
+        return None
+
+    if isinstance(raw, str):
+        raw = raw.encode("utf-8")
+
+    if len(raw) > 0 and raw[0] in codecs:
+        return codecs[raw[0]].decode(raw[1:])
+
+    return json.loads(raw)
@@ -0,0 +1,107 @@
+from datatypes.config import MythrilConfiguration
+
+jump_opcodes = {0x56, 0x57}
+push1, push32 = 0x60, 0x7f
+# seconds of the steps every analysis does: account summary, code fetch, disassembly and storing the result
+base_seconds = 5
+static_seconds_per_kb = 0.5
+# mythril explores paths between jumps, more jumps mean more states per transaction
+symbolic_seconds_per_jump = 0.05
+default_max_depth = 128
+default_solver_timeout = 10000
+# (queue, highest estimated seconds), analyses are routed to the first tier their estimate fits in
+cost_tiers = [("analysis_small", 60), ("analysis_medium", 300),
+              ("analysis_large", None)]
+# worker concurrency of each tier, must match the workers started in docker-compose
+tier_workers = {"analysis_small": 4, "analysis_medium": 2, "analysis_large": 1}
+# celery's redis transport orders messages of a queue by these steps, lower is served first
+priority_steps = list(range(10))
+# entries of crashed workers are dropped from the backlog after this time
+backlog_timeout = 60 * 60 * 6  # 6 hours
+backlog_prefix = "analysis-backlog"
+
+
+def scan_bytecode(code):
+    '''
+    Size in bytes and number of JUMP/JUMPI instructions of hex bytecode, push data is skipped
+    '''
+    if code == None:
+        return 0, 0
+
+    code = bytes.fromhex(code[2:] if code.startswith("0x") else code)
+    jumps = 0
+    pc = 0
+    while pc < len(code):
+        opcode = code[pc]
+        if opcode in jump_opcodes:
+            jumps += 1
+        elif push1 <= opcode <= push32:
+            pc += opcode - push1 + 1
+        pc += 1
+
+    return len(code), jumps
+
+
+def estimate_cost(code, mythril_args=None):
+    '''
+    Estimated seconds an analysis of the bytecode takes with the given mythril limits.
+    The symbolic execution grows with the jumps, the depth and the transaction count but never exceeds its timeouts.
+    Without bytecode the timeouts are used as the estimate.
+    '''
+    config = MythrilConfiguration(mythril_args or {})
+    size, jumps = scan_bytecode(code)
+
+    symbolic_limit = config.execution_timeout() + config.create_timeout()
+    if code == None:
+        symbolic = symbolic_limit
+    else:
+        symbolic = jumps * symbolic_seconds_per_jump * config.transaction_count() * \
+            max(config.max_depth() / default_max_depth, 1) * \
+            max(config.solver_timeout() / default_solver_timeout, 1)
+
+    return round(base_seconds + size / 1024 * static_seconds_per_kb + min(symbolic, symbolic_limit))
+
+
+def tier_for_cost(cost):
+    '''
+    Queue and priority of an analysis, cheaper analyses of a tier are served first
+    '''
+    lower = 0
+    for queue, limit in cost_tiers:
+        if limit == None or cost <= limit:
+            break
+        lower = limit
+
+    # the last tier has no upper limit, its priorities are spread over the same range as the tier before
+    span = (limit if limit != None else 2 * lower) - lower
+    step = int((cost - lower) / span * len(priority_steps)) if span > 0 else 0
+
+    return queue, priority_steps[min(step, len(priority_steps) - 1)]
+
+
+def backlog_key(queue):
+    return f"{backlog_prefix}-{queue}"
+
+
+def backlog_member(task_id, cost):
+    return f"{task_id}:{cost}"
+
+
+def add_to_backlog(redis, queue, task_id, cost):
+    redis.add_expiring(backlog_key(queue), backlog_member(
+        task_id, cost), backlog_timeout)
+
+
+def remove_from_backlog(redis, queue, task_id, cost):
+    redis.remove_member(backlog_key(queue), backlog_member(task_id, cost))
+
+
+def estimated_wait(redis, queue, cost):
+    '''
+    Seconds until an analysis queued now is finished.
+    Queued and running analyses are counted with their full estimate so the wait is an upper bound.
+    '''
+    backlog = sum(int(member.rsplit(":", 1)[1])
+                  for member in redis.get_members(backlog_key(queue)))
+
+    return round(backlog / tier_workers[queue]) + cost
@@ -1,5 +1,26 @@
 import json
-from mythril.analysis.ops import get_variable, VarType
+import sha3
+import hashlib
+import uuid
+from ethpector.utils import strip_0x
+from datatypes.instructions import compact_instructions, expand_instructions
+
+
+def bytecode_hash(code):
+    # keccak of the runtime bytecode, identical code (clones, proxies, ...) shares one analysis
+    return "0x" + sha3.keccak_256(bytes.fromhex(strip_0x(code))).hexdigest()
+
+
+def analysis_key(code_hash, mythril_args):
+    # analyses of the same bytecode with different mythril arguments are stored next to each other
+    config_hash = hashlib.sha1(json.dumps(
+        mythril_args, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    return f"{code_hash}-{config_hash}"
+
+
+def parts_key(key):
+    # every stored stage writes its blocks, functions and files under a new generation of the analysis key
+    return f"{key}-{uuid.uuid4().hex[:12]}"
 
 
 def is_conditional_jump(last):
@@ -26,9 +47,10 @@ def generate_jumps(bb, pc_to_block, conditional=False):
 
 
 def add_annotations(bb, symbolic, disassembly):
-    # adding all annotations to the basic block object
+    # adding all annotations to the basic block object, symbolic is None in the static stage of an analysis
     for inst in bb.instructions:
-        inst.annotations += symbolic.get_annotations_valid_at(inst.pc())
+        if symbolic != None:
+            inst.annotations += symbolic.get_annotations_valid_at(inst.pc())
         inst.annotations += disassembly.get_annotations_valid_at(inst.pc())
     bb.propagage_block_annotations()
 
@@ -111,3 +133,97 @@ def add_symbolics(symbolic, blocks, pc_to_block):
         addTypeToBlock(
             blocks[pc_to_block[int(_calldatacopies.pc)]], "calldatacopies")
 
+
+
+def create_render_data(analysis):
+    # build the blocks and coverage returned by the load route from a stored analysis document
+    # only run by the worker, the analysis types import mythril
+    from datatypes.json_mapping import json_to_assembly, json_to_basic_blocks, json_to_symbolic
+
+    disassembly_summary = json_to_assembly(analysis['disassembly_summary'])
+    # analyses in their static stage have no symbolic summary yet
+    symbolic_summary = json_to_symbolic(
+        analysis['symbolic_summary']) if analysis['symbolic_summary'] != None else None
+    bbs = json_to_basic_blocks(analysis['bbs'])
+    pc_to_block = {int(k): int(v) for k, v in analysis['pc_to_block'].items()}
+
+    blocks = []
+
+    # create dict that maps all instructions to each block
+    for _id, bb in enumerate(bbs):
+        block_dict = create_block_dict(_id, bb)
+
+        blocks.append(block_dict)
+
+    if symbolic_summary != None:
+        add_symbolics(symbolic_summary, blocks, pc_to_block)
+
+    # calculate coverage
+    ac = (
+        (int(disassembly_summary.unique_instructions_visited) /
+         int(disassembly_summary.total_instructions))
+        if int(disassembly_summary.total_instructions) > 0
+        else 0
+    )
+    sc = (
+        (int(symbolic_summary.unique_instructions_visited) /
+         int(disassembly_summary.total_instructions))
+        if int(disassembly_summary.total_instructions) > 0
+        else 0
+    ) if symbolic_summary != None else None
+    coverage = {"assembly": ac, "symbolic": sc}
+
+    return {"blocks": blocks, "coverage": coverage}
+
+
+def compact_block(block):
+    # stored blocks (analysis bbs and render blocks) keep their instructions in columnar form
+    block['instructions'] = compact_instructions(block['instructions'])
+    return block
+
+
+def expand_block(block):
+    block['instructions'] = expand_instructions(block['instructions'])
+    return block
+
+
+def block_documents(key, blocks, links):
+    # one document per block with its links so parts of the graph can be loaded without the whole analysis
+    outgoing = {block['i']: [] for block in blocks}
+    incoming = {block['i']: [] for block in blocks}
+    for link in links:
+        source, target = int(link['source']), int(link['target'])
+        if source in outgoing:
+            outgoing[source].append(link)
+        if target in incoming:
+            incoming[target].append(source)
+
+    return [{"key": key, "i": block['i'], "block": block, "links": outgoing[block['i']], "predecessors": incoming[block['i']]} for block in blocks]
+
+
+def collect_subgraph(start, find_blocks, hops, limit, backwards=True):
+    '''
+    breadth first search over block documents starting at block index start
+    find_blocks loads the documents for a list of block indices, hops=None searches until no new blocks are found
+    returns the blocks in index order and only the links between returned blocks
+    '''
+    documents = {}
+    frontier = [start]
+    depth = 0
+    while len(frontier) > 0 and len(documents) < limit and (hops == None or depth <= hops):
+        found = list(find_blocks(frontier[:limit - len(documents)]))
+        next_frontier = set()
+        for document in found:
+            documents[document['i']] = document
+            next_frontier.update(int(link['target'])
+                                 for link in document['links'])
+            if backwards:
+                next_frontier.update(document['predecessors'])
+        frontier = sorted(next_frontier.difference(documents))
+        depth += 1
+
+    blocks = [documents[i]['block'] for i in sorted(documents)]
+    links = [link for i in sorted(documents) for link in documents[i]['links']
+             if int(link['target']) in documents]
+
+    return {"blocks": blocks, "links": links}
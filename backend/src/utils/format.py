@@ -38,3 +38,23 @@ def format_transactions(transactions):
             transaction['timeStamp'])
 
     return transactions
+
+
+def queued_tasks(task_dict, status, names):
+    # tasks of the workers returned by celery inspect, tasks with other names are left out
+    tasks = []
+    for worker in task_dict:
+        for task in task_dict[worker]:
+            if task['type'] not in names:
+                continue
+            formatted_task = {}
+            formatted_task['contract'] = task['args'][0]
+            formatted_task['args'] = task['args'][2]
+            formatted_task['timestamp'] = str_timestamp_to_date(
+                int(task['time_start']))
+            formatted_task['type'] = task['type']
+            formatted_task['id'] = task['id']
+            formatted_task['status'] = status
+            tasks.append(formatted_task)
+
+    return tasks
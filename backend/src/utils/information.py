@@ -1,24 +1,91 @@
 import requests
 import os
 from ethpector.utils import strip_0x, get_function_selector
-from ethpector.data.signatures import SignatureProvider
-from ethpector.classify.parser import EventDefinition, FunctionDefinition
 from eth_abi import abi
 from hexbytes import HexBytes
 from utils.format import str_timestamp_to_date
+from utils.signatures import signature_cache, function_definition, event_definition
+from utils.metrics import metrics
 from web3 import Web3
-from ethpector.abi import AbiJson
 import sha3
+from concurrent.futures import ThreadPoolExecutor
+import concurrent.futures
+import threading
+import time
 
 
 etherscan_base = "https://api.etherscan.io/api"
 
-signature_provider = SignatureProvider()
+rpc_batch_size = 100
+rpc_timeout = 30
+# number of most recent logs shown and block chunks requested at the same time
+log_limit = 50
+# transactions shown on one page
+page_size = 50
+scan_concurrency = 4
+# most recent transactions kept per address, blocks near the head are fetched again in case of reorgs
+history_size = 200
+reorg_depth = 12
+# seconds a route waits for a single upstream call once it runs
+upstream_timeout = 20
+# seconds a call may wait for a free worker of the shared pool before the route gives up
+upstream_queue_timeout = 60
+log_scan_timeout = 60
+upstream_workers = 16
 
+upstream_executor = ThreadPoolExecutor(max_workers=upstream_workers)
+UpstreamTimeout = concurrent.futures.TimeoutError
 
-def etherscan_contract_creation(token, address, eth):
+
+class UpstreamCall(object):
+    '''
+    Future of an upstream call that records when a worker of the shared pool starts it,
+    so that time spent waiting for a free worker does not count towards the timeout of the call.
+    '''
+
+    def __init__(self, call):
+        self.started = threading.Event()
+        self.start = None
+        self.future = upstream_executor.submit(self.run, call)
+
+    def run(self, call):
+        self.start = time.monotonic()
+        self.started.set()
+        return call()
+
+
+def submit_upstream(calls):
+    '''
+    Starts independent upstream calls at the same time.
+    Returns an UpstreamCall for each name, results are read with upstream_result.
+    '''
+    return {name: UpstreamCall(metrics.upstream_call(call, call=name)) for name, call in calls.items()}
+
+
+def upstream_result(call, timeout=upstream_timeout):
+    # raises the error of the call or UpstreamTimeout if it waits too long for a worker or runs longer than timeout
+    if not call.started.wait(upstream_queue_timeout):
+        call.future.cancel()
+        raise UpstreamTimeout()
+
+    return call.future.result(timeout=max(timeout - (time.monotonic() - call.start), 0))
+
+
+def quantity(value):
+    # etherscan proxy results are hex strings
+    return value if isinstance(value, int) else int(value, base=0)
+
+
+def normalize_creation(transaction):
+    # block numbers are returned and cached as integers whether the transaction comes from etherscan or the cache
+    if transaction and transaction.get('blockNumber') != None:
+        return {**transaction, "blockNumber": quantity(transaction['blockNumber'])}
+    return transaction
+
+
+def etherscan_contract_creation(token, address, eth, cache=None):
     resp = requests.get(
-        f"{etherscan_base}?module=contract&action=getcontractcreation&contractaddresses={address}&apiKey={token}")
+        f"{etherscan_base}?module=contract&action=getcontractcreation&contractaddresses={address}&apiKey={token}", timeout=upstream_timeout)
     creator_res = resp.json()
 
     if "message" not in creator_res:
@@ -31,45 +98,134 @@ def etherscan_contract_creation(token, address, eth):
         return (None, None, None)
 
     creation = creator_res['result'][0]
-    transaction = creation['txHash'] if 'txHash' in creation else None
+    transaction_hash = creation['txHash'] if 'txHash' in creation else None
     creator = creation['contractCreator'] if 'contractCreator' in creation else None
-    transaction = eth.get_proxy_transaction_by_hash(txhash=transaction)
+
+    # mined transactions and blocks never change so they are only requested once
+    transaction = cache.get(
+        "transaction", transaction_hash) if cache != None else None
+    if transaction == None:
+        transaction = normalize_creation(
+            eth.get_proxy_transaction_by_hash(txhash=transaction_hash))
+        if cache != None and transaction_hash != None and transaction:
+            cache.set("transaction", transaction_hash, transaction)
+    else:
+        # entries cached before the block number was normalized
+        transaction = normalize_creation(transaction)
+
     block_number = transaction['blockNumber'] if 'blockNumber' in transaction else None
-    block = eth.get_proxy_block_by_number(tag=block_number)
-    contract_timestamp = block['timestamp'] if 'timestamp' in block else None
+    contract_timestamp = cache.get(
+        "block-timestamp", block_number) if cache != None and block_number != None else None
+    if contract_timestamp == None:
+        block = eth.get_proxy_block_by_number(tag=hex(block_number) if block_number != None else None)
+        contract_timestamp = quantity(
+            block['timestamp']) if 'timestamp' in block else None
+        if cache != None and block_number != None and contract_timestamp != None:
+            cache.set("block-timestamp", block_number, contract_timestamp)
 
     return (transaction, creator, contract_timestamp)
 
 
-def etherscan_transactions(address, eth, max_blocks):
-
-    txs = []
-    latest_block = int(eth.get_proxy_block_number(), base=0)
-    start_block = latest_block - max_blocks
+def etherscan_list(request):
+    # etherscan answers empty lists with an error
     try:
-        txs = eth.get_normal_txs_by_address(
-            address=address, startblock=start_block, endblock=latest_block, sort="desc")
+        return request()
     except AssertionError as assertError:
         if ("No transactions found" in assertError.args[0]):
-            txs = []
-        else:
-            return {"task_error": {"message": "txs failure", "status": 500}}
-    except Exception as error:
-        return {"task_error": {"message": "txs failure", "status": 500}}
+            return []
+        raise
 
-    int_txs = []
-    try:
-        int_txs = eth.get_internal_txs_by_address(
-            address=address, startblock=start_block, endblock=latest_block, sort="desc")
-    except AssertionError as assertError:
-        if ("No transactions found" in assertError.args[0]):
-            int_txs = []
-        else:
-            return {"task_error": {"message": "internal txs failure", "status": 500}}
-    except Exception as error:
-        return {"task_error": {"message": "internal txs failure", "status": 500}}
 
-    return (txs, int_txs)
+def transaction_history(address, eth, max_blocks, store):
+    '''
+    Most recent normal and internal transactions of an address newest first.
+    The history is kept in the store with the last fetched block as watermark,
+    later calls only fetch the blocks after the watermark and merge them.
+    '''
+    address = address.lower()
+    latest_block = int(eth.get_proxy_block_number(), base=0)
+    history = store.find_history(address)
+
+    if history == None:
+        start_block = max(latest_block - max_blocks, 0)
+        stored_normal = []
+        stored_internal = []
+    else:
+        start_block = max(history['watermark'] - reorg_depth + 1, 0)
+        stored_normal = [tx for tx in history['normal']
+                         if int(tx['blockNumber']) < start_block]
+        stored_internal = [tx for tx in history['internal']
+                           if int(tx['blockNumber']) < start_block]
+
+    # only the page that is kept is requested
+    normal = etherscan_list(lambda: eth.get_normal_txs_by_address_paginated(
+        address=address, page=1, offset=history_size, startblock=start_block, endblock=latest_block, sort="desc"))
+    internal = etherscan_list(lambda: eth.get_internal_txs_by_address_paginated(
+        address=address, page=1, offset=history_size, startblock=start_block, endblock=latest_block, sort="desc"))
+
+    normal = (normal + stored_normal)[:history_size]
+    internal = (internal + stored_internal)[:history_size]
+    store.save_history(address, latest_block, normal, internal)
+
+    return (normal, internal)
+
+
+def parse_cursor(cursor):
+    # cursors are a block number and an index in that block separated by a dash
+    block, index = cursor.split("-")
+    return (int(block), int(index))
+
+
+def format_cursor(block, index):
+    return f"{block}-{index}"
+
+
+def next_cursor(items, index_key):
+    '''
+    Cursor of the last item of a full page, None if there are no more items.
+    index_key is the position of the item in its block (transactionIndex or logIndex).
+    '''
+    if len(items) < page_size:
+        return None
+
+    return format_cursor(int(items[-1]['blockNumber']), int(items[-1][index_key]))
+
+
+def next_internal_cursor(items, cursor=None):
+    '''
+    Internal transactions have no index in the block, their cursor counts
+    how many of the internal transactions of the block were already shown.
+    '''
+    if len(items) < page_size:
+        return None
+
+    block = int(items[-1]['blockNumber'])
+    shown = sum(1 for item in items if int(item['blockNumber']) == block)
+    if cursor != None and cursor[0] == block:
+        shown += cursor[1]
+
+    return format_cursor(block, shown)
+
+
+def transactions_before(address, eth, cursor, max_blocks):
+    '''
+    Page of the normal transactions older than the cursor (block, transaction index) newest first.
+    Transactions of the cursor block from the previous page are requested again and dropped.
+    '''
+    block, _ = cursor
+    txs = etherscan_list(lambda: eth.get_normal_txs_by_address_paginated(
+        address=address, page=1, offset=2 * page_size, startblock=max(block - max_blocks, 0), endblock=block, sort="desc"))
+
+    return [tx for tx in txs if (int(tx['blockNumber']), int(tx['transactionIndex'])) < cursor][:page_size]
+
+
+def internal_transactions_before(address, eth, cursor, max_blocks):
+    # page of the internal transactions after the already shown ones of the cursor block
+    block, shown = cursor
+    txs = etherscan_list(lambda: eth.get_internal_txs_by_address_paginated(
+        address=address, page=1, offset=page_size + shown, startblock=max(block - max_blocks, 0), endblock=block, sort="desc"))
+
+    return [tx for position, tx in enumerate(txs) if position >= shown or int(tx['blockNumber']) != block][:page_size]
 
 
 def decode_transactions(web3prov, address, txs, abi=None):
@@ -100,8 +256,11 @@ def decode_transactions(web3prov, address, txs, abi=None):
                 signature = get_function_selector(tx['input'])
                 if signature is None:
                     continue
-                name = signature_provider.function_name(signature)[0]
-                fd = FunctionDefinition(name)
+                names = signature_cache.function_name(signature)
+                if len(names) == 0:
+                    continue
+                name = names[0]
+                fd = function_definition(name)
                 tx['functionName'] = name
                 try:
                     tx['functionArguments'] = fd.decode_input_to_str(
@@ -115,11 +274,14 @@ def decode_transactions(web3prov, address, txs, abi=None):
 def decode_log_no_abi(log):
     topics = log['topics']
     try:
-        name = signature_provider.event_name(topics[0].hex())[0]
+        names = signature_cache.event_name(topics[0].hex())
     except Exception as exception:
         print(f"event lookup failed with following exception: {exception}")
         return None
-    event_decode = EventDefinition(name)
+    if len(names) == 0:
+        return None
+    name = names[0]
+    event_decode = event_definition(name)
     types = event_decode.param_types()
     indexed_amount = len(topics) - 1
     try:
@@ -150,7 +312,7 @@ def decode_log_no_abi(log):
     return (name, indexed_values, unindexed_values)
 
 
-def decode_log_abi(web3prov, log, contract, mapping):
+def decode_log_abi(log, contract, mapping):
 
     topic_signature = log['topics'][0].hex()
 
@@ -161,30 +323,78 @@ def decode_log_abi(web3prov, log, contract, mapping):
 
     event = contract.events[signature.split("(")[0]]
 
-    receipt = web3prov.eth.getTransactionReceipt(log['transactionHash'])
-    for receipt_log in receipt['logs']:
-        if receipt['logs'][0]['topics'][0].hex() == topic_signature:
-            try:
-                processed_log = event().processLog(receipt_log)
-                indexed_dict = dict([(input['name'], input['indexed'])
-                                    for input in event().abi['inputs']])
-                indexed = [{name: str(indexed)} for name, indexed in processed_log['args'].items(
-                ) if indexed_dict[name]]
-                unindexed = [{name: indexed} for name, indexed in processed_log['args'].items(
-                ) if not indexed_dict[name]]
-                return (signature, indexed, unindexed)
-            except Exception as exception:
-                print(
-                    f"Decoding log failed with following message {exception}")
-                return None
-
-
-def decode_events(web3prov, address, logs, abi=None):
+    # logs from get_logs have the same format as the receipt logs so no receipt lookup is needed
+    try:
+        processed_log = event().processLog(log)
+        indexed_dict = dict([(input['name'], input['indexed'])
+                            for input in event().abi['inputs']])
+        indexed = [{name: str(indexed)} for name, indexed in processed_log['args'].items(
+        ) if indexed_dict[name]]
+        unindexed = [{name: indexed} for name, indexed in processed_log['args'].items(
+        ) if not indexed_dict[name]]
+        return (signature, indexed, unindexed)
+    except Exception as exception:
+        print(
+            f"Decoding log failed with following message {exception}")
+        return None
+
+
+def rpc_batch(web3prov, calls):
+    '''
+    Sends (method, params) json-rpc calls as batch requests.
+    Returns the results in the order of the calls, None for calls that failed.
+    '''
+    results = [None] * len(calls)
+    for start in range(0, len(calls), rpc_batch_size):
+        payload = [{"jsonrpc": "2.0", "id": start + index, "method": method, "params": params}
+                   for index, (method, params) in enumerate(calls[start:start + rpc_batch_size])]
+        with metrics.timer("upstream_seconds", call="rpc_batch"):
+            response = requests.post(
+                web3prov.provider.endpoint_uri, json=payload, timeout=rpc_timeout)
+        responses = response.json()
+        if not isinstance(responses, list):
+            # providers without batch support answer with a single error object
+            raise ValueError(f"batch request not supported: {responses}")
+        for item in responses:
+            if item.get('result') is not None:
+                results[item['id']] = item['result']
+
+    return results
+
+
+def block_timestamps(web3prov, block_numbers, cache=None):
+    # timestamps of all blocks in one batch request, each block only requested once
+    block_numbers = sorted(set(block_numbers))
+    timestamps = cache.get_many(
+        "block-timestamp", block_numbers) if cache != None else {}
+    missing = [number for number in block_numbers if number not in timestamps]
+
+    if len(missing) > 0:
+        try:
+            blocks = rpc_batch(web3prov, [("eth_getBlockByNumber", [
+                               hex(number), False]) for number in missing])
+            fetched = {number: int(block['timestamp'], base=16) for number, block in zip(
+                missing, blocks) if block is not None}
+        except Exception as exception:
+            print(f"batch block lookup failed, falling back to single requests: {exception}")
+            fetched = {number: web3prov.eth.getBlock(
+                number).timestamp for number in missing}
+
+        if cache != None:
+            cache.set_many("block-timestamp", fetched)
+        timestamps.update(fetched)
+
+    return timestamps
+
+
+def decode_events(web3prov, address, logs, abi=None, cache=None):
     events = []
 
     contract = None
 
     if abi != None:
+        # ethpector.abi imports mythril
+        from ethpector.abi import AbiJson
 
         try:
             contract = web3prov.eth.contract(address, abi=abi)
@@ -199,13 +409,15 @@ def decode_events(web3prov, address, logs, abi=None):
                 "utf-8")).hexdigest().lower()), signature) for signature in event_signatures])
 
     if logs:
+        timestamps = block_timestamps(
+            web3prov, [log['blockNumber'] for log in logs], cache)
+
         for log in logs:
 
             decoded_log = None
 
-
             if contract:
-                decoded_log = decode_log_abi(web3prov, log, contract, signature_mapping)
+                decoded_log = decode_log_abi(log, contract, signature_mapping)
             # if abi failed or not available use custom function
             if decoded_log == None:
                 decoded_log = decode_log_no_abi(log)
@@ -218,40 +430,79 @@ def decode_events(web3prov, address, logs, abi=None):
 
                 name, indexed_values, unindexed_values = decoded_log
 
-            block = web3prov.eth.getTransaction(log.transactionHash).blockNumber
-
-            timestamp = web3prov.eth.getBlock(block).timestamp
+            timestamp = timestamps.get(log['blockNumber'])
 
             events.append({"signature": name, "indexedValues": indexed_values, "unindexedValues": unindexed_values,
-                        "timestamp":  str_timestamp_to_date(timestamp), "transactionHash": log['transactionHash'].hex()})
+                           "timestamp": str_timestamp_to_date(timestamp), "transactionHash": log['transactionHash'].hex()})
 
     return events
 
 
-def retrieve_events(web3prov, address, eth, max_blocks, starting_max):
-
-    latest_block = int(eth.get_proxy_block_number(), base=0)
-    start_block = latest_block - starting_max
-
-    current_blocks = starting_max
-
-    logs = None
-    # limit down blocks until only 1000 results in query left (1000 most recent transaction)
-    while (logs == None or len(logs) < 50) and current_blocks <= max_blocks and current_blocks > 1000:
-        try:
-            logs = web3prov.eth.get_logs(
-                {"fromBlock": start_block, "address": address})
-        except ValueError:
-            current_blocks /= 2
-            start_block = int(latest_block - current_blocks)
-
-        if logs != None and len(logs) < 50:
-            current_blocks *= 10
-            start_block = int(latest_block - current_blocks)
-
-    if logs:
-        logs.reverse()
-
-        logs = logs[:50]
-
-    return logs
+def fetch_log_chunk(web3prov, address, from_block, to_block, limit=None, before=None):
+    '''
+    Logs of the block range newest first and whether the range had to be split.
+    Ranges the provider refuses (result cap, timeout) are split in halves, the newer half is fetched first
+    and the older one is skipped once limit logs are found. With a cursor as before only older logs are returned.
+    '''
+    try:
+        logs = metrics.upstream_call(lambda: web3prov.eth.get_logs(
+            {"fromBlock": from_block, "toBlock": to_block, "address": address}), call="get_logs")()
+        logs = list(reversed(logs))
+        if before != None:
+            logs = [log for log in logs if (
+                log['blockNumber'], log['logIndex']) < before]
+        return (logs, False)
+    except ValueError:
+        if to_block <= from_block:
+            return ([], True)
+
+    middle = (from_block + to_block) // 2
+    newer, _ = fetch_log_chunk(
+        web3prov, address, middle + 1, to_block, limit, before)
+    if limit != None and len(newer) >= limit:
+        return (newer, True)
+
+    older, _ = fetch_log_chunk(web3prov, address, from_block, middle,
+                               None if limit == None else limit - len(newer), before)
+
+    return (newer + older, True)
+
+
+def retrieve_events(web3prov, address, eth, max_blocks, starting_max, limit=log_limit, before=None):
+    '''
+    Collects the most recent logs by walking back from the head in chunks of blocks.
+    Several chunks are fetched concurrently, the chunk size shrinks when the provider refuses ranges
+    and grows while chunks are sparse.
+    With a (block, log index) cursor as before only older logs are collected.
+    '''
+    latest_block = int(eth.get_proxy_block_number(),
+                       base=0) if before == None else before[0]
+    lowest_block = max(latest_block - max_blocks, 0)
+
+    chunk_size = starting_max
+    to_block = latest_block
+    logs = []
+
+    with ThreadPoolExecutor(max_workers=scan_concurrency) as executor:
+        while len(logs) < limit and to_block >= lowest_block:
+            ranges = []
+            while len(ranges) < scan_concurrency and to_block >= lowest_block:
+                from_block = max(to_block - chunk_size + 1, lowest_block)
+                ranges.append((from_block, to_block))
+                to_block = from_block - 1
+
+            # no chunk needs more logs than are missing for the page
+            remaining = limit - len(logs)
+            chunks = list(executor.map(lambda block_range: fetch_log_chunk(
+                web3prov, address, *block_range, remaining, before), ranges))
+
+            # ranges are ordered from newest to oldest
+            for chunk_logs, _ in chunks:
+                logs += chunk_logs
+
+            if any(split for _, split in chunks):
+                chunk_size = max(chunk_size // 2, 1)
+            elif sum(len(chunk_logs) for chunk_logs, _ in chunks) < limit:
+                chunk_size = min(chunk_size * 2, max_blocks)
+
+    return logs[:limit]
@@ -0,0 +1,156 @@
+from collections import defaultdict
+from contextlib import contextmanager
+import threading
+import resource
+import time
+import re
+
+# samples of all processes are summed up in redis so one scrape of /metrics covers the web tier and the workers
+metrics_key = "metrics"
+peaks_key = "metrics-peaks"
+namespace = "ctrleth"
+# seconds, from cache lookups to deep mythril runs
+duration_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                    1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800]
+label_pattern = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+suffix_order = {"_bucket": 0, "_sum": 1, "_count": 2}
+# name: (type, help) of every exposed metric
+families = {
+    "request_seconds": ("histogram", "Seconds of flask requests by endpoint and status"),
+    "task_seconds": ("histogram", "Seconds of celery tasks by task and state"),
+    "analysis_step_seconds": ("histogram", "Seconds of the steps of an analysis stage"),
+    "upstream_seconds": ("histogram", "Seconds of etherscan and rpc calls"),
+    "upstream_errors_total": ("counter", "Failed etherscan and rpc calls"),
+    "cache_requests_total": ("counter", "Cache lookups by cache and result"),
+    "single_flight_total": ("counter", "Single flight cache computations by outcome"),
+    "peak_rss_bytes": ("gauge", "Highest resident set size of the processes of a worker"),
+}
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def sample(name, labels):
+    # prometheus sample name like ctrleth_upstream_seconds_count{call="balance"}, labels are sorted so equal samples share a field
+    text = ",".join(f'{label}="{escape(value)}"' for label,
+                    value in sorted(labels.items()))
+    return f"{namespace}_{name}{{{text}}}"
+
+
+def sort_key(field):
+    # the buckets of a series are listed in increasing order of their bound, followed by its sum and count
+    name, labels = field.split("{", 1)
+    labels = label_pattern.findall(labels)
+    bound = float(dict(labels).get("le", 0))
+    suffix = next((order for suffix, order in suffix_order.items()
+                  if name.endswith(suffix)), 0)
+    return ([label for label in labels if label[0] != "le"], suffix, bound)
+
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metrics(object):
+    """
+    Counters and histograms of one process.
+    Samples are collected in memory and added to redis by flush, which runs after every request and task.
+    """
+
+    def __init__(self, redis=None):
+        self.redis = redis
+        self.pending = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def increment(self, name, amount=1, **labels):
+        with self.lock:
+            self.pending[sample(name, labels)] += amount
+
+    def observe(self, name, value, **labels):
+        # buckets are cumulative like in the exposition format, every bucket of a series exists
+        with self.lock:
+            for bound in duration_buckets:
+                self.pending[sample(f"{name}_bucket", {
+                    **labels, "le": bound})] += 1 if value <= bound else 0
+            self.pending[sample(f"{name}_bucket", {**labels, "le": "+Inf"})] += 1
+            self.pending[sample(f"{name}_sum", labels)] += value
+            self.pending[sample(f"{name}_count", labels)] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def upstream_call(self, function, **labels):
+        # function wrapped so its duration and errors are recorded, it can be run in a thread pool
+        def timed():
+            with self.timer("upstream_seconds", **labels):
+                try:
+                    return function()
+                except Exception:
+                    self.increment("upstream_errors_total", **labels)
+                    raise
+        return timed
+
+    def record_peak_rss(self, process):
+        # ru_maxrss is in kilobytes on linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        if self.redis != None:
+            try:
+                self.redis.set_max(peaks_key, sample(
+                    "peak_rss_bytes", {"process": process}), peak)
+            except Exception as exception:
+                print(f"metrics update failed with following error: {exception}")
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, defaultdict(float)
+
+        if self.redis == None or len(pending) == 0:
+            return
+
+        try:
+            self.redis.increment_many(metrics_key, pending)
+        except Exception as exception:
+            print(f"metrics flush failed with following error: {exception}")
+
+
+def render(samples):
+    '''
+    Prometheus text exposition of {sample: value}, samples are grouped by their family
+    '''
+    grouped = defaultdict(list)
+    for field, value in samples.items():
+        base = field.split("{", 1)[0][len(namespace) + 1:]
+        for suffix in ["_bucket", "_sum", "_count"]:
+            if base.endswith(suffix) and base[:-len(suffix)] in families:
+                base = base[:-len(suffix)]
+        grouped[base].append((field, value))
+
+    lines = []
+    for name, (kind, description) in families.items():
+        if name not in grouped:
+            continue
+        lines.append(f"# HELP {namespace}_{name} {description}")
+        lines.append(f"# TYPE {namespace}_{name} {kind}")
+        lines += [f"{field} {format_value(value)}" for field,
+                  value in sorted(grouped[name], key=lambda item: sort_key(item[0]))]
+
+    return "\n".join(lines) + "\n"
+
+
+def collect(redis, flight_stats_key):
+    # samples of all processes together with the single flight counters kept by utils.redis
+    samples = redis.get_values(metrics_key)
+    samples.update(redis.get_values(peaks_key))
+    for outcome, value in redis.get_counters(flight_stats_key).items():
+        samples[sample("single_flight_total", {"outcome": outcome})] = value
+
+    return samples
+
+
+metrics = Metrics()
@@ -1,16 +1,196 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING
+from web3 import Web3
+import gridfs
+import datetime
 import os
+import threading
 from shared import app
+from datatypes.config import mythril_limits
+
+# bumped whenever the stored analysis format changes, older documents are analysed again
+analysis_version = 9
+# indexes of the parts when analyses were stored by bytecode hash alone
+# replaced generations are deleted after this many seconds so that loads still streaming them are not cut off
+retired_parts_grace = 60 * 10  # 10 minutes
+legacy_indexes = [("contracts", "code_hash_1"), ("blocks",
+                                                 "code_hash_1_i_1"), ("functions", "code_hash_1_index_1")]
+
+client = None
+client_pid = None
+client_lock = threading.Lock()
+
+
+def shared_client():
+    '''
+    One pooled client per process that is shared by all requests and tasks.
+    MongoClient is not fork safe, so forked processes like the celery prefork children create their own.
+    '''
+    global client, client_pid
+    with client_lock:
+        if client is None or client_pid != os.getpid():
+            host = app.config["DB_HOST"]
+            user = os.getenv('MONGO_INITDB_ROOT_USERNAME')
+            password = os.getenv('MONGO_INITDB_ROOT_PASSWORD')
+            client = MongoClient(
+                f'mongodb://{user}:{password}@{host}:27017/', connect=False)
+            client_pid = os.getpid()
+
+    return client
+
 
 class Mongo():
 
     def __init__(self):
-        host = app.config["DB_HOST"]
-        user = os.getenv('MONGO_INITDB_ROOT_USERNAME')
-        password = os.getenv('MONGO_INITDB_ROOT_PASSWORD')
-        self.client = MongoClient(f'mongodb://{user}:{password}@{host}:27017/')
-        print(f'mongodb://{user}:{password}@{host}:27017/')
+        self.client = shared_client()
         self.db = self.client['ctrleth']
+        self.files = gridfs.GridFS(self.db, collection='analysis_files')
+
+    def find_analysis(self, address, projection=None):
+        # analyses are stored by bytecode hash and mythril arguments, addresses only point to the bytecode hash
+        mapping = self.db['addresses'].find_one({"address": address.lower()})
+        if mapping is None:
+            return None
+
+        return self.find_analysis_by_hash(mapping['code_hash'], projection)
+
+    def find_analysis_by_hash(self, code_hash, projection=None):
+        # the latest complete analysis of the bytecode, it was only started because no earlier one covered its arguments
+        # analyses whose symbolic stage is still running are returned if there is no complete one
+        return self.db['contracts'].find_one({"code_hash": code_hash, "version": analysis_version}, projection, sort=[("stages.symbolic", -1), ("_id", -1)])
+
+    def find_dominating_analysis(self, code_hash, config, projection=None):
+        # a complete analysis whose mythril limits are at least the requested ones, config is normalized
+        query = {"code_hash": code_hash, "version": analysis_version, "stages.symbolic": True,
+                 "config.mythril_concolic": config["mythril_concolic"], "config.strategy": config["strategy"]}
+        for limit in mythril_limits:
+            query[f"config.{limit}"] = {"$gte": config[limit]}
+
+        return self.db['contracts'].find_one(query, projection, sort=[("_id", -1)])
+
+    def link_address(self, address, code_hash):
+        # looked up by the lowercase address, the checksum address is returned because web3 rejects lowercase ones
+        self.db['addresses'].update_one({"address": address.lower()}, {
+                                        "$set": {"code_hash": code_hash, "checksum": Web3.toChecksumAddress(address)}}, upsert=True)
+
+    # parts of an analysis are stored under the generation its document points to, see utils.disassembly.parts_key
+    def find_blocks(self, key, query=None, projection=None):
+        # block documents ordered by their index
+        query = query if query else {}
+        projection = projection if projection else {}
+        return self.db['blocks'].find({"key": key, **query}, {"_id": 0, **projection}).sort("i", 1)
+
+    def find_functions(self, key):
+        return self.db['functions'].find({"key": key}, {"_id": 0, "entrypoint": 1, "function": 1}).sort("index", 1)
+
+    def find_function(self, key, index):
+        return self.db['functions'].find_one({"key": key, "index": index}, {"_id": 0, "entrypoint": 1, "function": 1})
+
+    def insert_parts(self, collection, documents):
+        if len(documents) > 0:
+            self.db[collection].insert_many(documents, ordered=False)
+
+    def save_blocks(self, key, blocks):
+        self.insert_parts('blocks', blocks)
+
+    def save_functions(self, key, functions):
+        self.insert_parts('functions', [{"key": key, "index": index, **function}
+                                        for index, function in enumerate(functions)])
+
+    def body_filename(self, key):
+        return f"{key}-{analysis_version}.json.gz"
+
+    def find_compressed_body(self, key):
+        # gzip compressed load response of an analysis, None for analyses stored before it was added
+        return self.files.find_one({"filename": self.body_filename(key)})
+
+    def new_compressed_body(self, key):
+        # file the compressed response is written to
+        return self.files.new_file(filename=self.body_filename(key), contentType="application/json", contentEncoding="gzip")
+
+    def delete_parts(self, parts):
+        self.db['blocks'].delete_many({"key": parts})
+        self.db['functions'].delete_many({"key": parts})
+        # generations stored before the raw summaries were dropped also have a raw summary file
+        for filename in [parts, self.body_filename(parts)]:
+            for old_file in self.files.find({"filename": filename}):
+                self.files.delete(old_file._id)
+
+    def retire_parts(self, parts):
+        self.db['retired_parts'].insert_one(
+            {"parts": parts, "retired": datetime.datetime.utcnow()})
+
+    def delete_retired_parts(self):
+        # generations that were replaced longer ago than any load takes
+        deadline = datetime.datetime.utcnow() - datetime.timedelta(seconds=retired_parts_grace)
+        for retired in self.db['retired_parts'].find({"retired": {"$lt": deadline}}):
+            self.delete_parts(retired['parts'])
+            self.db['retired_parts'].delete_one({"_id": retired['_id']})
+
+    def save_analysis(self, address, code_hash, analysis, blocks, functions, write_body=None):
+        '''
+        Writes the parts of a new generation and points the analysis document to them as the last write.
+        The previous generation is deleted after retired_parts_grace so that readers still loading it get complete parts.
+        write_body is called with the document to store the compressed body before the document is replaced.
+        '''
+        parts = analysis["parts"]
+        analysis["version"] = analysis_version
+        try:
+            self.save_blocks(parts, blocks)
+            self.save_functions(parts, functions)
+            if write_body != None:
+                write_body(analysis)
+        except Exception:
+            self.delete_parts(parts)
+            raise
+
+        # upsert so that clones analysed at the same time do not create duplicates
+        previous = self.db['contracts'].find_one_and_replace(
+            {"key": analysis["key"]}, analysis, {"key": 1, "parts": 1}, upsert=True)
+        self.link_address(address, code_hash)
+        if previous != None:
+            # documents stored before generations were introduced kept their parts under the analysis key
+            self.retire_parts(previous.get("parts", previous["key"]))
+        try:
+            self.delete_retired_parts()
+        except Exception as exception:
+            # the analysis is stored, retired parts are deleted by a later save
+            print(f"deleting retired parts failed with following error: {exception}")
+
+    def find_history(self, address):
+        # stored transactions of an address and the last block they were fetched for
+        return self.db['histories'].find_one({"address": address}, {"_id": 0})
+
+    def save_history(self, address, watermark, normal, internal):
+        self.db['histories'].update_one({"address": address}, {"$set": {
+            "watermark": watermark, "normal": normal, "internal": internal}}, upsert=True)
+
+    def analysed_addresses(self):
+        # mappings stored before the checksum address was kept only have the lowercase address
+        return [mapping.get("checksum", Web3.toChecksumAddress(mapping['address'])) for mapping in self.db['addresses'].find({}, {"_id": 0, "address": 1, "checksum": 1})]
+
+    def create_indexes(self):
+        # the parts of older analyses would collide on the unique bytecode hash indexes
+        for collection, index in legacy_indexes:
+            if index in self.db[collection].index_information():
+                self.db[collection].drop_index(index)
+                # older parts are never loaded again because the analysis version changed
+                if collection != "contracts":
+                    self.db[collection].delete_many(
+                        {"key": {"$exists": False}})
+        # create_index does nothing for indexes that already exist
+        self.db['addresses'].create_index("address", unique=True)
+        # analyses stored before the analysis key was introduced have no key
+        self.db['contracts'].create_index("key", unique=True, partialFilterExpression={
+                                          "key": {"$exists": True}})
+        self.db['contracts'].create_index(
+            [("code_hash", ASCENDING), ("version", ASCENDING)])
+        self.db['blocks'].create_index(
+            [("key", ASCENDING), ("i", ASCENDING)], unique=True)
+        self.db['functions'].create_index(
+            [("key", ASCENDING), ("index", ASCENDING)], unique=True)
+        self.db['histories'].create_index("address", unique=True)
+        self.db['retired_parts'].create_index("retired")
 
     def close(self):
-        self.client.close()
\ No newline at end of file
+        # the client is shared by the whole process and stays open
+        pass
@@ -0,0 +1,79 @@
+import json
+import time
+import uuid
+
+# workers publish the progress of the analyses of an address, the latest event is kept for clients that subscribe later
+progress_prefix = "analysis-progress"
+progress_ttl = 60 * 60  # 1 hour
+# the stream ends after no more than this many seconds, clients reconnect with the id of the last event they received
+stream_timeout = 25
+heartbeat = 5
+reconnect_delay = 1000  # milliseconds
+# after these events nothing more happens until the address is analysed again
+final_events = ["finished", "failed"]
+
+
+def progress_channel(address):
+    return f"{progress_prefix}-{address.lower()}"
+
+
+def publish_progress(redis, address, event, mythril_args=None, **data):
+    '''
+    Publishes a state transition of the analysis of an address to its subscribers
+    '''
+    message = {"id": uuid.uuid4().hex, "event": event, "address": address.lower(),
+               "config": mythril_args, "time": time.time(), **data}
+    try:
+        redis.publish(progress_channel(address), json.dumps(message), progress_ttl)
+    except Exception as exception:
+        # progress is only a notification, clients can still load the analysis
+        print(f"publishing progress failed with following error: {exception}")
+
+    return message
+
+
+def progress_events(redis, address, last_id=None, timeout=stream_timeout):
+    '''
+    Latest event of the address unless the client already received it, then the events published within timeout
+    None is yielded when nothing was published for a heartbeat so that the caller can keep the connection alive
+    '''
+    channel = progress_channel(address)
+    # subscribing before reading the latest event so no event is lost in between
+    subscription = redis.subscribe(channel)
+    try:
+        latest = redis.get_routes_from_cache(channel)
+        if latest != None:
+            event = json.loads(latest)
+            if event['id'] != last_id:
+                yield event
+                if event['event'] in final_events:
+                    return
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            message = subscription.get_message(
+                timeout=min(heartbeat, max(deadline - time.monotonic(), 0)))
+            if message == None:
+                yield None
+                continue
+
+            event = json.loads(message['data'])
+            yield event
+            if event['event'] in final_events:
+                return
+    finally:
+        subscription.close()
+
+
+def format_event(event):
+    # server sent event, None becomes a comment that only keeps the connection alive
+    if event == None:
+        return ": heartbeat\n\n"
+
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+
+def event_stream(events):
+    yield f"retry: {reconnect_delay}\n\n"
+    for event in events:
+        yield format_event(event)
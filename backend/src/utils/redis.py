@@ -1,13 +1,50 @@
 import redis
 from datetime import timedelta
+from collections import OrderedDict
+from utils import codec
+from utils.metrics import metrics
+import threading
+import time
+import uuid
 import sys
 import os
 
 ttl = 60 * 20  # 20 minutes
+# entries older than ttl are served stale while they are refreshed in the background until hard_ttl
+hard_ttl = 60 * 60 * 24  # 1 day
+# immutable entries never expire, redis evicts them with its allkeys-lru policy
+immutable_prefix = "immutable"
+immutable_local_size = 10000
+# single flight: seconds a computation may hold the lock and seconds other requests wait for its result
+flight_lock_timeout = 120
+flight_wait = 15
+flight_poll = 0.2
+# requests that waited in vain are asked to retry instead of computing the value a second time
+flight_retry_after = 5
+# previous values are served to waiting requests while a value is recomputed
+flight_previous_ttl = 60 * 60 * 24  # 1 day
+flight_stats_key = "single-flight-stats"
+
+set_max_script = """
+local current = redis.call('hget', KEYS[1], ARGV[1])
+if not current or tonumber(current) < tonumber(ARGV[2]) then
+    redis.call('hset', KEYS[1], ARGV[1], ARGV[2])
+end
+return 0
+"""
+
+release_lock_script = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
 
 
 class Redis(object):
-    def __init__(self):
+    def __init__(self, value_codec=None):
+        # values are written with this codec, entries of every codec and plain json can be read
+        self.codec = value_codec if value_codec != None else codec.default_codec()
         self.client = None
         try:
             client = redis.Redis(
@@ -39,6 +76,117 @@ class Redis(object):
             state = self.client.set(key, value=value)
         return state
 
+    def encode(self, value) -> bytes:
+        return self.codec.encode(value)
+
+    def decode(self, raw):
+        return codec.decode(raw)
+
+    def load_from_cache(self, key: str):
+        """Decoded value from redis."""
+
+        return self.decode(self.client.get(key))
+
+    def store_to_cache(self, key: str, value, ttl=0) -> bool:
+        """Encoded value to redis."""
+
+        return self.set_routes_to_cache(key, self.encode(value), ttl)
+
+    def set_fresh_to_cache(self, key: str, value, ttl=ttl, hard_ttl=hard_ttl):
+        """Encoded value to redis that is stale after ttl and removed after hard_ttl."""
+
+        pipeline = self.client.pipeline()
+        pipeline.set(key, ex=timedelta(seconds=hard_ttl),
+                     value=self.encode(value))
+        pipeline.set(f"{key}-fresh", ex=timedelta(seconds=ttl), value=1)
+        return all(pipeline.execute())
+
+    def is_fresh(self, key) -> bool:
+        return self.client.exists(f"{key}-fresh") > 0
+
+    def claim_refresh(self, key, timeout) -> bool:
+        # only one refresh task is queued for a stale entry
+        return self.client.set(f"{key}-refresh", 1, nx=True, ex=timeout) == True
+
+    def get_many_from_cache(self, keys):
+        """Data of several keys from redis in one round trip."""
+
+        return self.client.mget(keys)
+
+    def set_many_to_cache(self, values) -> bool:
+        """Data of several keys to redis without expiry."""
+
+        return self.client.mset(values)
+
+    def acquire_lock(self, key, timeout):
+        """Token of the acquired lock or None if it is held by someone else."""
+
+        token = uuid.uuid4().hex
+        if self.client.set(f"{key}-lock", token, nx=True, ex=timeout):
+            return token
+        return None
+
+    def release_lock(self, key, token):
+        # only the holder releases the lock, it may have expired and been taken by someone else
+        return self.client.eval(release_lock_script, 1, f"{key}-lock", token)
+
+    def is_locked(self, key) -> bool:
+        return self.client.exists(f"{key}-lock") > 0
+
+    def increment(self, key, field, amount=1):
+        return self.client.hincrby(key, field, amount)
+
+    def get_counters(self, key):
+        return {field.decode(): int(value) for field, value in self.client.hgetall(key).items()}
+
+    def increment_many(self, key, amounts):
+        """Adds the amounts to the fields of a hash in one round trip."""
+
+        pipeline = self.client.pipeline(transaction=False)
+        for field, amount in amounts.items():
+            pipeline.hincrbyfloat(key, field, amount)
+        return pipeline.execute()
+
+    def set_max(self, key, field, value):
+        # the field keeps the highest value that was set
+        return self.client.eval(set_max_script, 1, key, field, value)
+
+    def get_values(self, key):
+        return {field.decode(): float(value) for field, value in self.client.hgetall(key).items()}
+
+    def add_expiring(self, key, member, timeout):
+        """Member of a set that is dropped after timeout seconds."""
+
+        pipeline = self.client.pipeline()
+        pipeline.zadd(key, {member: time.time() + timeout})
+        pipeline.expire(key, timeout)
+        return pipeline.execute()
+
+    def remove_member(self, key, member) -> int:
+        return self.client.zrem(key, member)
+
+    def get_members(self, key):
+        """Members of a set that have not expired."""
+
+        pipeline = self.client.pipeline()
+        pipeline.zremrangebyscore(key, "-inf", time.time())
+        pipeline.zrange(key, 0, -1)
+        return [member.decode() for member in pipeline.execute()[1]]
+
+    def publish(self, channel, message, ttl):
+        """Message to the subscribers of a channel, it is kept under the channel name for later subscribers."""
+
+        pipeline = self.client.pipeline()
+        pipeline.set(channel, message, ex=timedelta(seconds=ttl))
+        pipeline.publish(channel, message)
+        return pipeline.execute()
+
+    def subscribe(self, channel):
+        # every subscription holds its own connection until it is closed
+        subscription = self.client.pubsub(ignore_subscribe_messages=True)
+        subscription.subscribe(channel)
+        return subscription
+
     def delete_key(self, key,) -> int:
         state = self.client.delete(key)
 
@@ -46,3 +194,178 @@ class Redis(object):
 
     def scan(self, pattern):
         return self.client.scan_iter(pattern)
+
+
+def previous_key(key):
+    return f"{key}-previous"
+
+
+def cached_value(redis, key, refresh=None):
+    """
+    Cached value of the key or None.
+    Stale values are returned as well and refresh is called once to recompute them in the background.
+    """
+
+    value = redis.load_from_cache(key)
+    if value == None:
+        metrics.increment("cache_requests_total", cache="route", result="miss")
+        return None
+
+    if refresh != None and not redis.is_fresh(key):
+        metrics.increment("cache_requests_total", cache="route", result="stale")
+        if redis.claim_refresh(key, flight_lock_timeout):
+            redis.increment(flight_stats_key, "refreshed")
+            try:
+                refresh()
+            except Exception as exception:
+                print(f"queueing cache refresh failed with following error: {exception}")
+    else:
+        metrics.increment("cache_requests_total", cache="route", result="hit")
+
+    return value
+
+
+def single_flight(redis, key, compute, refresh=None):
+    """
+    Computes a missing cache entry in only one request across all processes.
+    compute stores its result under key and returns the response. Other requests are served
+    the previous value or wait for the new one. One of them takes over if the first request fails,
+    the others are answered with 503 and Retry-After while the value is still computed.
+    """
+
+    value = cached_value(redis, key, refresh)
+    if value != None:
+        return value
+
+    token = redis.acquire_lock(key, flight_lock_timeout)
+    if token != None:
+        redis.increment(flight_stats_key, "computed")
+        return compute_locked(redis, key, compute, token)
+
+    previous = redis.load_from_cache(previous_key(key))
+    if previous != None:
+        redis.increment(flight_stats_key, "served_previous")
+        return previous
+
+    deadline = time.monotonic() + flight_wait
+    while time.monotonic() < deadline:
+        time.sleep(flight_poll)
+        # the lock is checked first because the value is stored before the lock is released
+        locked = redis.is_locked(key)
+        value = redis.load_from_cache(key)
+        if value != None:
+            redis.increment(flight_stats_key, "coalesced")
+            return value
+        if not locked:
+            # the computing request finished without storing a value, only one waiting request computes it again
+            token = redis.acquire_lock(key, flight_lock_timeout)
+            if token != None:
+                redis.increment(flight_stats_key, "computed_after_wait")
+                return compute_locked(redis, key, compute, token)
+
+    redis.increment(flight_stats_key, "busy")
+    return {"message": "Still loading, try again later", "type": 11}, 503, {"Retry-After": str(flight_retry_after)}
+
+
+def compute_locked(redis, key, compute, token):
+    # the value is kept as previous value for requests arriving while it is recomputed later
+    try:
+        result = compute()
+        value = redis.get_routes_from_cache(key)
+        if value != None:
+            redis.set_routes_to_cache(previous_key(
+                key), value=value, ttl=flight_previous_ttl)
+        return result
+    finally:
+        redis.release_lock(key, token)
+
+
+def refresh_entry(redis, key, compute):
+    """Recomputes a stale entry, skipped while a request computes the same key."""
+
+    token = redis.acquire_lock(key, flight_lock_timeout)
+    if token == None:
+        return False
+
+    try:
+        compute()
+    finally:
+        redis.release_lock(key, token)
+
+    return True
+
+
+class ImmutableCache(object):
+    """
+    Cache for chain data that never changes once it exists (block timestamps, transactions).
+    Entries are kept in process with lru eviction and without a ttl in redis so every worker shares them.
+    """
+
+    def __init__(self, redis=None, size=immutable_local_size):
+        self.redis = redis
+        self.size = size
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+
+    def key(self, namespace, key):
+        return f"{immutable_prefix}-{namespace}-{key}"
+
+    def remember(self, key, value):
+        with self.lock:
+            self.local[key] = value
+            self.local.move_to_end(key)
+            while len(self.local) > self.size:
+                self.local.popitem(last=False)
+
+    def get_many(self, namespace, keys):
+        """Cached values of the keys, keys without a value are left out."""
+
+        found = {}
+        missing = []
+        with self.lock:
+            for key in keys:
+                cache_key = self.key(namespace, key)
+                if cache_key in self.local:
+                    self.local.move_to_end(cache_key)
+                    found[key] = self.local[cache_key]
+                else:
+                    missing.append(key)
+
+        if self.redis != None and len(missing) > 0:
+            try:
+                values = self.redis.get_many_from_cache(
+                    [self.key(namespace, key) for key in missing])
+            except Exception as exception:
+                print(f"immutable cache lookup failed with following error: {exception}")
+                values = []
+            for key, value in zip(missing, values):
+                if value != None:
+                    found[key] = self.redis.decode(value)
+                    self.remember(self.key(namespace, key), found[key])
+
+        local = len(keys) - len(missing)
+        metrics.increment("cache_requests_total", local,
+                          cache=namespace, result="local")
+        metrics.increment("cache_requests_total", len(found) - local,
+                          cache=namespace, result="redis")
+        metrics.increment("cache_requests_total", len(keys) - len(found),
+                          cache=namespace, result="miss")
+
+        return found
+
+    def set_many(self, namespace, values):
+        for key, value in values.items():
+            self.remember(self.key(namespace, key), value)
+
+        if self.redis != None and len(values) > 0:
+            try:
+                self.redis.set_many_to_cache({self.key(namespace, key): self.redis.encode(
+                    value) for key, value in values.items()})
+            except Exception as exception:
+                print(f"immutable cache update failed with following error: {exception}")
+
+    def get(self, namespace, key):
+        return self.get_many(namespace, [key]).get(key)
+
+    def set(self, namespace, key, value):
+        self.set_many(namespace, {key: value})
@@ -0,0 +1,164 @@
+from collections import OrderedDict
+from functools import lru_cache
+from utils.metrics import metrics
+import threading
+import sqlite3
+import json
+import time
+import os
+
+# found signatures rarely change, unknown ones may be added to the signature databases at any time
+signature_ttl = 60 * 60 * 24 * 7  # 7 days
+negative_signature_ttl = 60 * 60  # 1 hour
+signature_local_size = 50000
+definition_cache_size = 4096
+signature_prefix = "signature"
+
+
+@lru_cache(maxsize=definition_cache_size)
+def function_definition(signature):
+    # parsed definitions only depend on the signature text
+    from ethpector.classify.parser import FunctionDefinition
+    return FunctionDefinition(signature)
+
+
+@lru_cache(maxsize=definition_cache_size)
+def event_definition(signature):
+    from ethpector.classify.parser import EventDefinition
+    return EventDefinition(signature)
+
+
+def normalize_selector(selector):
+    selector = selector.lower()
+    return selector if selector.startswith("0x") else "0x" + selector
+
+
+class SignatureCache(object):
+    """
+    Resolves function selectors and event topics to signatures.
+    Results are kept in an in-process lru and in redis, lookups without result are cached for a shorter time.
+    Signatures of a bulk loaded dump are never evicted.
+    """
+
+    def __init__(self, provider=None, redis=None, size=signature_local_size):
+        self._provider = provider
+        self.redis = redis
+        self.size = size
+        self.local = OrderedDict()
+        self.preloaded = {}
+        self.lock = threading.Lock()
+
+    @property
+    def provider(self):
+        # the signature provider opens mythril's signature database, which imports z3
+        if self._provider == None:
+            from ethpector.data.signatures import SignatureProvider
+            self._provider = SignatureProvider()
+        return self._provider
+
+    def key(self, kind, selector):
+        return f"{signature_prefix}-{kind}-{selector}"
+
+    def remember(self, key, signatures):
+        ttl = signature_ttl if len(signatures) > 0 else negative_signature_ttl
+        with self.lock:
+            self.local[key] = (signatures, time.monotonic() + ttl)
+            self.local.move_to_end(key)
+            while len(self.local) > self.size:
+                self.local.popitem(last=False)
+
+    def cached(self, key):
+        if key in self.preloaded:
+            metrics.increment("cache_requests_total",
+                              cache="signature", result="preloaded")
+            return self.preloaded[key]
+
+        with self.lock:
+            if key in self.local:
+                signatures, expires = self.local[key]
+                if expires > time.monotonic():
+                    self.local.move_to_end(key)
+                    metrics.increment("cache_requests_total",
+                                      cache="signature", result="local")
+                    return signatures
+                del self.local[key]
+
+        if self.redis != None:
+            try:
+                signatures = self.redis.load_from_cache(key)
+            except Exception as exception:
+                print(f"signature cache lookup failed with following error: {exception}")
+                signatures = None
+            if signatures != None:
+                self.remember(key, signatures)
+                metrics.increment("cache_requests_total",
+                                  cache="signature", result="redis")
+                return signatures
+
+        metrics.increment("cache_requests_total",
+                          cache="signature", result="miss")
+        return None
+
+    def lookup(self, kind, selector, resolve):
+        key = self.key(kind, normalize_selector(selector))
+        signatures = self.cached(key)
+        if signatures != None:
+            return signatures
+
+        # provider errors are not cached so the lookup is retried on the next call
+        signatures = list(resolve(selector) or [])
+        self.remember(key, signatures)
+
+        if self.redis != None:
+            try:
+                self.redis.store_to_cache(key, signatures, ttl=signature_ttl if len(
+                    signatures) > 0 else negative_signature_ttl)
+            except Exception as exception:
+                print(f"signature cache update failed with following error: {exception}")
+
+        return signatures
+
+    def function_name(self, selector):
+        """Signatures of a 4 byte function selector, empty if unknown."""
+
+        return self.lookup("function", selector, lambda selector: self.provider.function_name(selector))
+
+    def event_name(self, topic):
+        """Signatures of a 32 byte event topic, empty if unknown."""
+
+        return self.lookup("event", topic, lambda topic: self.provider.event_name(topic))
+
+    def prewarm(self, path):
+        """
+        Bulk loads signatures from a mythril signatures.db sqlite file or a json file
+        of the form {"functions": {selector: [signature]}, "events": {topic: [signature]}}.
+        Returns the number of loaded selectors.
+        """
+
+        if path.endswith(".json"):
+            with open(path) as dump:
+                data = json.load(dump)
+            entries = [("function", selector, signatures) for selector, signatures in data.get("functions", {}).items()] + \
+                [("event", topic, signatures)
+                 for topic, signatures in data.get("events", {}).items()]
+        else:
+            connection = sqlite3.connect(path)
+            try:
+                rows = connection.execute(
+                    "SELECT byte_sig, text_sig FROM signatures").fetchall()
+            finally:
+                connection.close()
+            functions = {}
+            for selector, signature in rows:
+                functions.setdefault(selector, []).append(signature)
+            entries = [("function", selector, signatures)
+                       for selector, signatures in functions.items()]
+
+        preloaded = {self.key(kind, normalize_selector(selector)): list(
+            signatures) for kind, selector, signatures in entries}
+        self.preloaded.update(preloaded)
+
+        return len(preloaded)
+
+
+signature_cache = SignatureCache()
@@ -1,8 +1,7 @@
-
-from ethpector.abi import AbiJson
-
-
 def categorize_abi_names(source_abi):
+    # ethpector.abi imports mythril, the source route loads it with the analysis anyway
+    from ethpector.abi import AbiJson
+
     if (type(source_abi) is not list):
         source_abi = None
     abi_json = AbiJson(source_abi)
@@ -192,6 +192,9 @@ export function mapStatusToMessage(error: ApiError): string {
     }
     return 'Invalid Input given!'
   }
+  if (error.status === 503 && error.type === 11) {
+    return 'The data is still being loaded, try again in a few seconds.';
+  }
 
   return 'Server failed to handle the request.';
 }
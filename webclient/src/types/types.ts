@@ -152,7 +152,7 @@ export type BasicContract = {
   creationTransaction: {
     hash: string;
     blockHash: string;
-    blockNumber: string;
+    blockNumber: number;
   };
 };
 